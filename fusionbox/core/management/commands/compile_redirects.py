@@ -0,0 +1,26 @@
+"""
+Compiles the CSV redirect files into a table for
+fusionbox.middleware.RedirectFallbackMiddleware
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from fusionbox.middleware import RedirectFallbackMiddleware, RedirectTable
+
+
+class Command(BaseCommand):
+    help = "Compiles all CSV redirect files into the memory mappable table used when settings.REDIRECTS_TABLE is set"
+    args = "[output_path]"
+
+    def handle(self, *args, **options):
+        if args:
+            path = args[0]
+        else:
+            path = getattr(settings, 'REDIRECTS_TABLE', None)
+        if not path:
+            raise CommandError('Pass an output path or set settings.REDIRECTS_TABLE')
+
+        middleware = RedirectFallbackMiddleware(use_table=False)
+        redirects = middleware.redirects.all()
+        RedirectTable.write(path, redirects)
+        self.stdout.write('Compiled %d redirects to %s\n' % (len(redirects), path))
@@ -0,0 +1,30 @@
+"""
+Lists the redirects of fusionbox.middleware.RedirectFallbackMiddleware that
+were not used recently
+"""
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from fusionbox.middleware import RedirectFallbackMiddleware, get_hit_sink
+
+
+class Command(BaseCommand):
+    help = "Lists the redirects without any hits in the last <days> days (30 by default), according to settings.REDIRECTS_HIT_SINK"
+    args = "[days]"
+
+    def handle(self, *args, **options):
+        sink = get_hit_sink()
+        if sink is None:
+            raise CommandError('settings.REDIRECTS_HIT_SINK is not set')
+        try:
+            days = int(args[0]) if args else 30
+        except ValueError:
+            raise CommandError('days must be an integer')
+
+        since = datetime.date.today() - datetime.timedelta(days=days)
+        hits = sink.get_hits(since)
+        redirects = RedirectFallbackMiddleware(raise_errors=False, use_table=False).redirects.all()
+        for redirect in sorted(redirects, key=lambda r: (r.filename, r.line_number)):
+            if not hits.get(redirect.source):
+                self.stdout.write(u'{redirect.filename}:{redirect.line_number} {redirect.source}\n'.format(redirect=redirect))
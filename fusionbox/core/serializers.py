@@ -1,18 +1,480 @@
+import re
+import copy
+import json
+from itertools import islice
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python 2.6
+    from ordereddict import OrderedDict
+
+try:
+    from collections.abc import Iterator
+except ImportError:
+    # python 2
+    from collections import Iterator
+
+import six
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.query import QuerySet
+try:
+    from django.core.exceptions import FieldDoesNotExist
+except ImportError:
+    # django < 1.8
+    from django.db.models.fields import FieldDoesNotExist
+from django.utils.timezone import utc
+
+orjson = None
+try:
+    import orjson
+except ImportError:
+    pass
+
+msgpack = None
+try:
+    import msgpack
+except ImportError:
+    pass
+
+cbor2 = None
+try:
+    import cbor2
+except ImportError:
+    pass
+
+
+# (encoder class, type) -> handler, cleared whenever a handler is registered.
+_handler_cache = {}
+
+# Returned by a handler when the object turns out not to have a to_json.
+NO_HANDLER = object()
+
+# How many items of an array iterstream encodes at once.
+STREAM_BATCH_SIZE = 100
+
+
+class StreamedValue(Exception):
+    """
+    Raised by :meth:`FusionboxJSONEncoder.iterstream` when a value it tried to
+    encode in one go contains a queryset or iterator.
+    """
+
+
+def call_to_json(o):
+    return o.to_json()
+
+
+def call_instance_to_json(o):
+    """
+    The handler for types whose instances could have a ``to_json`` the type
+    doesn't: objects with their own attributes and proxies like
+    SimpleLazyObject.
+    """
+    to_json = getattr(o, 'to_json', None)
+    if to_json is None:
+        return NO_HANDLER
+    return to_json()
+
+
+def get_attname(model, name):
+    """
+    Returns the attribute holding the value ``values()`` returns for the field
+    ``name`` of ``model``: the primary key rather than the related object for
+    a foreign key.
+    """
+    try:
+        return model._meta.get_field(name).attname
+    except FieldDoesNotExist:
+        # pk, or not a field at all
+        return name
+
+
+def is_values_queryset(qs):
+    """
+    Returns whether ``qs`` came from ``values()`` or ``values_list()``, and so
+    already returns its rows as dicts or tuples.
+    """
+    # ValuesQuerySet sets _fields on django < 1.9, QuerySet.__init__ sets it
+    # to None after that.
+    return getattr(qs, '_fields', None) is not None
 
 
 class FusionboxJSONEncoder(DjangoJSONEncoder):
     """
     Handles encoding querysets and objects with ``to_json()``.
+
+    Handlers for other types can be added with :meth:`register`, and models
+    can be given a ``values()``-based serializer with :meth:`register_model`.
+    The handler for a class is looked up once and cached.  ``to_json`` is
+    always called on the object itself, so it can be defined on the instance
+    or provided by a proxy's ``__getattr__``.
     """
-    def default(self, o):
+    handlers = {}
+    model_fields = {}
+
+    @classmethod
+    def register(cls, type_, handler):
+        """
+        Encode instances of ``type_`` (and its subclasses) with
+        ``handler(obj)``, which should return something JSON serializable.
+        """
+        if 'handlers' not in cls.__dict__:
+            cls.handlers = dict(cls.handlers)
+        cls.handlers[type_] = handler
+        _handler_cache.clear()
+
+    @classmethod
+    def register_model(cls, model, fields):
+        """
+        Encode instances of ``model`` as a dict of ``fields``, and querysets
+        of ``model`` with ``values(*fields)`` instead of building instances.
+        Either way, foreign keys are encoded as the related object's pk.
+        """
+        if 'model_fields' not in cls.__dict__:
+            cls.model_fields = dict(cls.model_fields)
+        fields = tuple(fields)
+        cls.model_fields[model] = fields
+        # Resolved on first use, when the model's relations are ready.
+        attnames = []
+
+        def handler(o):
+            if not attnames:
+                attnames.extend(get_attname(model, f) for f in fields)
+            return dict((f, getattr(o, attname)) for f, attname in zip(fields, attnames))
+        cls.register(model, handler)
+
+    @classmethod
+    def get_handler(cls, type_):
+        """
+        Returns the handler for instances of ``type_``, or ``None``.  The
+        handler may return ``NO_HANDLER`` for an object without a ``to_json``.
+        """
         try:
-            return o.to_json()
-        except AttributeError:
+            return _handler_cache[cls, type_]
+        except KeyError:
             pass
 
+        handler = None
+        for klass in type_.__mro__:
+            if klass in cls.handlers:
+                handler = cls.handlers[klass]
+                break
+        else:
+            if hasattr(type_, 'to_json'):
+                handler = call_to_json
+            elif hasattr(type_, '__getattr__') or type_.__dictoffset__:
+                handler = call_instance_to_json
+
+        _handler_cache[cls, type_] = handler
+        return handler
+
+    @classmethod
+    def has_handler(cls, type_):
+        """
+        Returns whether instances of ``type_`` are always encoded by a
+        handler (registered, or a ``to_json`` on the class).
+        """
+        handler = cls.get_handler(type_)
+        return handler is not None and handler is not call_instance_to_json
+
+    def encode_queryset(self, qs):
+        fields = self.model_fields.get(qs.model)
+        if fields is not None and not is_values_queryset(qs):
+            return list(qs.values(*fields))
+        return list(qs)
+
+    def iter_queryset(self, qs):
+        """
+        Like :meth:`encode_queryset`, but reads the rows with ``iterator()``
+        so they aren't all held in memory (or in the queryset's cache).
+        """
+        fields = self.model_fields.get(qs.model)
+        if fields is not None and not is_values_queryset(qs):
+            qs = qs.values(*fields)
+        return qs.iterator()
+
+    def iterstream(self, o):
+        """
+        Encodes ``o``, yielding string pieces as they are produced.
+
+        Querysets are encoded one row at a time with :meth:`iter_queryset`,
+        and iterators and generators are consumed lazily and encoded as
+        arrays.  Each value is first encoded in one go with :meth:`encode`
+        (one call per row, for instance), only the lists, tuples and dicts
+        that turn out to contain a queryset or iterator are walked.
+        ``indent`` and ``sort_keys`` are not supported.  Like ``json.dumps``,
+        a circular reference raises ``ValueError`` unless ``check_circular``
+        is off.
+        """
+        eager = copy.copy(self)
+
+        def default(o):
+            if isinstance(o, Iterator) or (isinstance(o, QuerySet) and not self.has_handler(type(o))):
+                raise StreamedValue
+            return self.default(o)
+        eager.default = default
+        return self._iterstream(o, eager, {} if self.check_circular else None)
+
+    def _iterstream(self, o, eager, markers):
+        try:
+            encoded = eager.encode(o)
+        except StreamedValue:
+            pass
+        else:
+            yield encoded
+            return
+
+        if markers is not None:
+            markerid = id(o)
+            if markerid in markers:
+                raise ValueError("Circular reference detected")
+            markers[markerid] = o
+
+        if isinstance(o, (list, tuple)):
+            chunks = self._iterstream_array(o, eager, markers)
+        elif isinstance(o, dict):
+            chunks = self._iterstream_object(o, eager, markers)
+        elif isinstance(o, QuerySet) and not self.has_handler(type(o)):
+            chunks = self._iterstream_array(self.iter_queryset(o), eager, markers)
+        else:
+            chunks = None
+            handler = self.get_handler(type(o))
+            if handler is not None:
+                value = handler(o)
+                if value is not NO_HANDLER:
+                    chunks = self._iterstream(value, eager, markers)
+            if chunks is None:
+                if isinstance(o, Iterator):
+                    chunks = self._iterstream_array(o, eager, markers)
+                else:
+                    chunks = self._iterstream(self.default(o), eager, markers)
+
+        for chunk in chunks:
+            yield chunk
+
+        if markers is not None:
+            del markers[markerid]
+
+    def _iterstream_array(self, items, eager, markers):
+        yield '['
+        first = True
+        items = iter(items)
+        while True:
+            # Encoded a batch at a time, since most of the cost of encoding a
+            # small row is in the call to encode.
+            batch = list(islice(items, STREAM_BATCH_SIZE))
+            if not batch:
+                break
+            try:
+                encoded = eager.encode(batch)
+            except StreamedValue:
+                for item in batch:
+                    if first:
+                        first = False
+                    else:
+                        yield self.item_separator
+                    for chunk in self._iterstream(item, eager, markers):
+                        yield chunk
+            else:
+                if first:
+                    first = False
+                else:
+                    yield self.item_separator
+                yield encoded[1:-1]
+        yield ']'
+
+    def _iterstream_object(self, o, eager, markers):
+        yield '{'
+        first = True
+        for key, value in six.iteritems(o):
+            if first:
+                first = False
+            else:
+                yield self.item_separator
+            if not isinstance(key, six.string_types):
+                key = self.encode(key)
+            yield self.encode(key)
+            yield self.key_separator
+            for chunk in self._iterstream(value, eager, markers):
+                yield chunk
+        yield '}'
+
+    def default(self, o):
+        handler = self.get_handler(type(o))
+        if handler is not None:
+            value = handler(o)
+            if value is not NO_HANDLER:
+                return value
+
         if isinstance(o, QuerySet):
-            return list(o)
+            return self.encode_queryset(o)
 
         return super(FusionboxJSONEncoder, self).default(o)
+
+
+if orjson is not None:
+    # Dates and times are passed through to ``default`` so they are formatted
+    # the same way as DjangoJSONEncoder formats them.
+    ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME |
+                      orjson.OPT_PASSTHROUGH_DATACLASS |
+                      orjson.OPT_NON_STR_KEYS)
+
+
+HTML_ESCAPES = {
+    u'<': u'\\u003c',
+    u'>': u'\\u003e',
+    u'&': u'\\u0026',
+    # Line terminators in JavaScript, but not in JSON
+    u'\u2028': u'\\u2028',
+    u'\u2029': u'\\u2029',
+}
+
+HTML_ESCAPE_RE = re.compile(u'[<>&\u2028\u2029]')
+NON_ASCII_RE = re.compile(u'[^\x00-\x7f]')
+# The non-ASCII characters and the HTML/XML special characters, everything
+# but < (0x3c), > (0x3e) and & (0x26) in the ASCII range.
+HTML_NON_ASCII_RE = re.compile(u'[^\x00-\x25\x27-\x3b\x3d\x3f-\x7f]')
+
+
+def escape_char(match):
+    c = match.group()
+    try:
+        return HTML_ESCAPES[c]
+    except KeyError:
+        pass
+    code = ord(c)
+    if code > 0xffff:
+        # outside the BMP, escaped as a surrogate pair like the json module does
+        code -= 0x10000
+        return u'\\u%04x\\u%04x' % (0xd800 | (code >> 10), 0xdc00 | (code & 0x3ff))
+    return u'\\u%04x' % code
+
+
+def escape_non_ascii(json_str):
+    """
+    Replaces the non-ASCII characters in a JSON string with their unicode
+    escapes, like ``json.dumps`` does with ``ensure_ascii``.
+    """
+    return NON_ASCII_RE.sub(escape_char, json_str)
+
+
+def escape_html(json_str):
+    """
+    Replaces the HTML/XML special characters (and the characters that end a
+    line in JavaScript) in a JSON string with their unicode escapes, in a
+    single pass.  The result is still valid JSON.
+    """
+    return HTML_ESCAPE_RE.sub(escape_char, json_str)
+
+
+def dumps(obj, cls=FusionboxJSONEncoder, html_safe=False, **kwargs):
+    """
+    Serializes ``obj`` to a JSON string, like ``json.dumps``.  Without
+    formatting arguments the output is compact and ASCII only.  With
+    ``html_safe``, the output is also passed through :func:`escape_html`.
+
+    When orjson is installed and no formatting arguments are given, it is
+    used instead of the json module, with ``cls().default`` handling the types
+    it doesn't know about, and the same output.  Anything orjson refuses
+    (integers that don't fit in 64 bits, for instance) falls back to the json
+    module.
+    """
+    if not kwargs:
+        if orjson is not None:
+            try:
+                json_str = orjson.dumps(obj, default=cls().default, option=ORJSON_OPTIONS).decode('utf-8')
+            except orjson.JSONEncodeError:
+                pass
+            else:
+                # One pass for both the ASCII and the HTML escaping
+                regex = HTML_NON_ASCII_RE if html_safe else NON_ASCII_RE
+                return regex.sub(escape_char, json_str)
+        kwargs['separators'] = (',', ':')
+    json_str = json.dumps(obj, cls=cls, **kwargs)
+    if html_safe:
+        return escape_html(json_str)
+    return json_str
+
+
+def stream(obj, cls=FusionboxJSONEncoder, chunk_size=16384, **kwargs):
+    """
+    Serializes ``obj`` like :func:`dumps`, but returns an iterator of strings
+    of about ``chunk_size`` characters.  Querysets are read in batches with
+    ``iterator()``, so memory use doesn't grow with the number of rows.
+    """
+    buf = []
+    size = 0
+    for piece in cls(**kwargs).iterstream(obj):
+        buf.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield ''.join(buf)
+
+
+# content type -> (dumps, loads)
+FORMATS = OrderedDict()
+
+
+def register_format(content_type, dumps, loads):
+    """
+    Makes ``content_type`` available to content negotiation in
+    ``fusionbox.views.rest``.  ``dumps(obj)`` should encode with
+    FusionboxJSONEncoder semantics and ``loads(data)`` decode a request
+    body.
+    """
+    FORMATS[content_type] = (dumps, loads)
+
+
+def get_format(content_type):
+    """
+    Returns the ``(dumps, loads)`` pair for ``content_type``, or ``None``.
+    """
+    return FORMATS.get(content_type)
+
+
+register_format('application/json', dumps, json.loads)
+
+
+def binary_default(cls=FusionboxJSONEncoder):
+    """
+    Returns a ``default`` function for the binary encoders: FusionboxJSONEncoder's,
+    plus iterators and generators (which the JSON encoder only handles when
+    streaming) become lists, since these formats are always encoded whole.
+    """
+    default = cls().default
+
+    def binary_default(o):
+        if isinstance(o, Iterator):
+            return list(o)
+        return default(o)
+    return binary_default
+
+
+# Both binary formats encode types they don't know about with
+# FusionboxJSONEncoder.default.  MessagePack has no date or decimal types, so
+# those come out as strings like they do in JSON, but CBOR encodes datetimes,
+# dates and Decimals with its own standard tags, which CBOR decoders turn back
+# into the native types.
+if msgpack is not None:
+    def msgpack_dumps(obj, cls=FusionboxJSONEncoder):
+        return msgpack.packb(obj, default=binary_default(cls), use_bin_type=True)
+
+    def msgpack_loads(data):
+        return msgpack.unpackb(data, raw=False)
+
+    register_format('application/msgpack', msgpack_dumps, msgpack_loads)
+    register_format('application/x-msgpack', msgpack_dumps, msgpack_loads)
+
+if cbor2 is not None:
+    def cbor_dumps(obj, cls=FusionboxJSONEncoder):
+        default = binary_default(cls)
+        # Naive datetimes are taken to be UTC.
+        return cbor2.dumps(obj, timezone=utc,
+                           default=lambda encoder, o: encoder.encode(default(o)))
+
+    register_format('application/cbor', cbor_dumps, cbor2.loads)
@@ -1,15 +1,12 @@
-from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+from decimal import Decimal, InvalidOperation
 import random
 from six.moves.urllib.parse import urlencode
 
-# `setlocale` is not threadsafe
-import locale
-locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
-
 import re
+import six
+import hashlib
 import warnings
 import calendar
-from json import dumps as json_dumps
 
 inflect = None
 try:
@@ -22,16 +19,23 @@ from django import forms
 from django import template
 from django.conf import settings
 from django.forms.models import model_to_dict
+from django.template.base import TextNode
 from django.template.defaultfilters import stringfilter
 
 from bs4 import BeautifulSoup
 from django.utils.safestring import mark_safe
-from django.contrib.humanize.templatetags.humanize import intcomma
 from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import receiver
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    # django < 1.8
+    from django.test.signals import setting_changed
 
 import phonenumbers
-from fusionbox.core.serializers import FusionboxJSONEncoder
-from fusionbox.core.utils import format_us_phonenumber
+from fusionbox.core.serializers import FusionboxJSONEncoder, dumps as json_dumps
+from fusionbox.core.utils import format_us_phonenumber, LRUCache, format_number, quantize_half_up
 
 register = template.Library()
 
@@ -40,6 +44,147 @@ def addclass(elem, cls):
     elem['class'] = elem.get('class', []) + [cls]
 
 
+# Start and end tags, comments are matched so they can be skipped.
+TAG_RE = re.compile(r'''<!--.*?-->|<(/?)([a-zA-Z][^\s/>]*)((?:[^>"']|"[^"]*"|'[^']*')*)>''', re.S)
+ATTR_RE = re.compile(r'''([^\s/=>"']+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?''')
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+])
+RAW_TEXT_ELEMENTS = frozenset(['script', 'style'])
+
+
+class Tag(object):
+    """
+    The position of a start tag in a string of HTML and of its class
+    attribute, as found by :func:`scan_anchors`.
+    """
+    __slots__ = ('start', 'insert_at', 'class_span', 'class_value')
+
+    def __init__(self, start, insert_at, class_span, class_value):
+        self.start = start
+        self.insert_at = insert_at
+        self.class_span = class_span
+        self.class_value = class_value
+
+
+class Anchor(object):
+    __slots__ = ('href', 'tag', 'parent')
+
+    def __init__(self, href, tag, parent):
+        self.href = href
+        self.tag = tag
+        self.parent = parent
+
+
+def scan_anchors(html):
+    """
+    Returns an :class:`Anchor` for every ``<a href="...">`` in ``html``,
+    with the :class:`Tag` of the anchor and of its parent element.
+
+    This is a streaming tokenizer, no DOM is built.  Unclosed elements are
+    only closed by the end tag of an element containing them.
+    """
+    anchors = []
+    stack = []
+    pos = 0
+    while True:
+        m = TAG_RE.search(html, pos)
+        if m is None:
+            break
+        pos = m.end()
+        name = m.group(2)
+        if name is None:
+            # A comment
+            continue
+        name = name.lower()
+        if m.group(1):
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] == name:
+                    del stack[i:]
+                    break
+            continue
+
+        attrs_start = m.start(3)
+        insert_at = attrs_start
+        class_span = class_value = href = None
+        for attr in ATTR_RE.finditer(m.group(3)):
+            insert_at = attrs_start + attr.end()
+            attr_name = attr.group(1).lower()
+            value = attr.group(2)
+            if value is None:
+                value = ''
+            elif value[0] in '"\'':
+                value = value[1:-1]
+            if attr_name == 'class':
+                class_span = (attrs_start + attr.start(), attrs_start + attr.end())
+                class_value = value
+            elif attr_name == 'href':
+                href = value.replace('&amp;', '&')
+        tag = Tag(m.start(), insert_at, class_span, class_value)
+
+        if name == 'a' and href is not None:
+            anchors.append(Anchor(href, tag, stack[-1][1] if stack else None))
+
+        if name in RAW_TEXT_ELEMENTS:
+            end = html.lower().find('</' + name, pos)
+            pos = len(html) if end == -1 else end
+        elif name not in VOID_ELEMENTS and not m.group(3).rstrip().endswith('/'):
+            stack.append((name, tag))
+    return anchors
+
+
+def add_class_to_tags(html, tags, cls):
+    """
+    Returns ``html`` with ``cls`` added to the class attribute of every
+    :class:`Tag` in ``tags``.
+    """
+    tags = sorted(dict((tag.start, tag) for tag in tags).values(), key=lambda tag: tag.start)
+    out = []
+    pos = 0
+    for tag in tags:
+        if tag.class_span is None:
+            out.append(html[pos:tag.insert_at])
+            out.append(' class="%s"' % cls)
+            pos = tag.insert_at
+        else:
+            value = ' '.join(filter(None, [tag.class_value, cls])).replace('"', '&quot;')
+            out.append(html[pos:tag.class_span[0]])
+            out.append('class="%s"' % value)
+            pos = tag.class_span[1]
+    out.append(html[pos:])
+    return ''.join(out)
+
+
+def content_digest(content):
+    return hashlib.md5(content.encode('utf-8')).digest()
+
+
+_highlight_cache = None
+
+
+def get_highlight_cache():
+    """
+    Returns the :class:`~fusionbox.core.utils.LRUCache` of
+    :class:`HighlightHereNode` outputs, or ``None`` if
+    ``settings.HIGHLIGHT_HERE_CACHE_SIZE`` is not set.
+    """
+    global _highlight_cache
+    if _highlight_cache is None:
+        size = getattr(settings, 'HIGHLIGHT_HERE_CACHE_SIZE', 0)
+        _highlight_cache = LRUCache(size) if size else False
+    if _highlight_cache is False:
+        return None
+    return _highlight_cache
+
+
+@receiver(setting_changed)
+def reset_highlight_cache(setting, **kwargs):
+    global _highlight_cache
+    if setting == 'HIGHLIGHT_HERE_CACHE_SIZE':
+        _highlight_cache = None
+
+
 def is_here(current, url):
     """
     Determine if current is 'underneath' url.
@@ -64,6 +209,9 @@ class HighlighterBase(template.Node):
     Each templatetag accepts an optional ``self.highlight_class`` parameter and
     all other options are stored in ``self.options``.  This behavior can be
     overriden by implementing the ``parse_options`` method.
+
+    This parses the rendered output with BeautifulSoup on every render.
+    :class:`HighlightHereNode` avoids that.
     """
     def __init__(self, parser, token):
         self.parse_options(token.split_contents())
@@ -135,26 +283,95 @@ class HighlightHereNode(HighlighterBase):
         <a href="/" class="home">/</a>
         <a href="/blog/" class="here">blog</a>
 
+    When the content of the tag is static, the anchors are found once, when
+    the template is compiled, and rendering only inserts the classes.
+    Otherwise the rendered content is scanned with :func:`scan_anchors`.
+    Subclasses overriding ``elems_to_highlight`` or ``highlight`` get the
+    BeautifulSoup behavior of :class:`HighlighterBase`.
+
+    Set ``settings.HIGHLIGHT_HERE_CACHE_SIZE`` to remember that many outputs,
+    keyed by a hash of the content and the current path, so rendering the
+    same menu on the same page again skips the HTML processing.
     """
     def __init__(self, parser, token):
         super(HighlightHereNode, self).__init__(parser, token)
 
         self.highlight_class = self.highlight_class or 'here'
 
-    def elems_to_highlight(self, soup, context):
+        cls = type(self)
+        self.use_soup = (
+            six.get_unbound_function(cls.highlight) is not six.get_unbound_function(HighlighterBase.highlight) or
+            six.get_unbound_function(cls.elems_to_highlight) not in (
+                six.get_unbound_function(HighlightHereNode.elems_to_highlight),
+                six.get_unbound_function(HighlightHereParentNode.elems_to_highlight),
+            )
+        )
+        if all(isinstance(node, TextNode) for node in self.nodelist):
+            self.static_content = ''.join(node.s for node in self.nodelist)
+            self.static_anchors = scan_anchors(self.static_content)
+            self.static_digest = content_digest(self.static_content)
+        else:
+            self.static_content = self.static_anchors = self.static_digest = None
+
+    def get_path(self, context):
         try:
-            path = template.Variable(self.options[0]).resolve(context)
+            return template.Variable(self.options[0]).resolve(context)
         except template.VariableDoesNotExist:
-            path = self.options[0]
+            return self.options[0]
         except IndexError:
             if 'request' in context:
-                path = context['request'].path
+                return context['request'].path
             else:
                 raise ImproperlyConfigured(
                         "The request was not available in the context, please ensure that the request is made available in the context.")
 
+    def elems_to_highlight(self, soup, context):
+        path = self.get_path(context)
         return (anchor for anchor in soup.findAll('a', {'href': True}) if is_here(path, anchor['href']))
 
+    def tags_to_highlight(self, anchors, path):
+        """
+        Returns the :class:`Tag` objects to add the class to.
+        """
+        return (anchor.tag for anchor in anchors if is_here(path, anchor.href))
+
+    def render(self, context):
+        if self.use_soup:
+            return super(HighlightHereNode, self).render(context)
+
+        if self.static_content is not None:
+            content = self.static_content
+        else:
+            content = self.nodelist.render(context)
+
+        try:
+            path = self.get_path(context)
+        except ImproperlyConfigured as e:
+            if settings.DEBUG:
+                raise
+            else:
+                # See HighlighterBase.render
+                warnings.warn(e.args[0])
+                return content
+
+        output_cache = get_highlight_cache()
+        if output_cache is not None:
+            digest = self.static_digest or content_digest(content)
+            key = (self.__class__, self.highlight_class, path, digest)
+            output = output_cache.get(key)
+            if output is None:
+                output = self.highlight_content(content, path)
+                output_cache.set(key, output)
+            return output
+        return self.highlight_content(content, path)
+
+    def highlight_content(self, content, path):
+        if content is self.static_content:
+            anchors = self.static_anchors
+        else:
+            anchors = scan_anchors(content)
+        return add_class_to_tags(content, self.tags_to_highlight(anchors, path), self.highlight_class)
+
 
 register.tag("highlight_here", HighlightHereNode)
 
@@ -193,6 +410,10 @@ class HighlightHereParentNode(HighlightHereNode):
         for anchor in super(HighlightHereParentNode, self).elems_to_highlight(soup, href):
             yield anchor.parent
 
+    def tags_to_highlight(self, anchors, path):
+        return (anchor.parent for anchor in anchors
+                if anchor.parent is not None and is_here(path, anchor.href))
+
 register.tag("highlight_here_parent", HighlightHereParentNode)
 
 
@@ -219,12 +440,7 @@ def json(a):
     if settings.DEBUG:
         kwargs['indent'] = 4
         kwargs['separators'] = (',', ': ')
-    json_str = json_dumps(a, cls=FusionboxJSONEncoder, **kwargs)
-
-    # Escape all the XML/HTML special characters.
-    escapes = ['<', '>', '&']
-    for c in escapes:
-        json_str = json_str.replace(c, r'\u%04x' % ord(c))
+    json_str = json_dumps(a, cls=FusionboxJSONEncoder, html_safe=True, **kwargs)
 
     # now it's safe to use mark_safe
     return mark_safe(json_str)
@@ -240,9 +456,7 @@ def currency(dollars):
     Taken from:
     http://stackoverflow.com/a/2180209/1013960
     """
-    dollars = float(dollars)
-
-    return "$%s%s" % (intcomma(int(dollars)), ("%0.2f" % dollars)[-3:])
+    return get_number_formatter('currency')(dollars)
 
 
 if hasattr(settings, 'FORMAT_TAG_ERROR_VALUE'):
@@ -251,6 +465,98 @@ else:
     FORMAT_TAG_ERROR_VALUE = 'error'
 
 
+class NumberFormatter(object):
+    """
+    Formats numbers like one of the number filters with a given argument.
+    Everything that doesn't depend on the value (rounding exponent, format
+    string) is computed once, so the same formatter can be applied to many
+    values cheaply, see :func:`format_column`.
+
+    ``convert`` turns a value into a Decimal (or a float), ``quantize_places``
+    is the number of places a Decimal is rounded (half up) to and ``places``
+    the number of places displayed.
+    """
+    def __init__(self, convert, quantize_places, places, prefix=u'', suffix=u''):
+        self.convert = convert
+        self.quantize_places = quantize_places
+        self.places = places
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def __call__(self, value):
+        try:
+            value = self.convert(value)
+        except (InvalidOperation, TypeError, ValueError):
+            return FORMAT_TAG_ERROR_VALUE
+        if isinstance(value, Decimal):
+            if not value.is_finite():
+                return FORMAT_TAG_ERROR_VALUE
+            value = quantize_half_up(value, self.quantize_places)
+        return format_number(value, self.places, self.prefix, self.suffix)
+
+
+class CentsFormatter(NumberFormatter):
+    """
+    ``us_cents`` works on floats and takes the sign of the unrounded value,
+    so -0.01 is -0.0.
+    """
+    def __call__(self, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return FORMAT_TAG_ERROR_VALUE
+        formatted = format_number(abs(value), self.places, suffix=self.suffix)
+        return (u'-' if value < 0 else u'') + formatted
+
+
+class CurrencyFormatter(NumberFormatter):
+    """
+    ``currency`` truncates the dollars and takes the cents from the value
+    rounded to two places.  Invalid values raise instead of being formatted
+    as ``FORMAT_TAG_ERROR_VALUE``.
+    """
+    def __call__(self, value):
+        value = float(value)
+        return u'%s%s%s' % (self.prefix, format_number(int(value), 0), (u'%0.2f' % value)[-3:])
+
+
+def decimal_from_str(value):
+    return Decimal(str(value))
+
+
+_number_formatters = {}
+
+
+def get_number_formatter(name, arg=None):
+    """
+    Returns the :class:`NumberFormatter` for the filter ``name`` with argument
+    ``arg`` (``None`` for the default).
+    """
+    key = (name, arg)
+    try:
+        return _number_formatters[key]
+    except KeyError:
+        pass
+    if name == 'us_dollars':
+        formatter = NumberFormatter(Decimal, 0, 0, u'$')
+    elif name == 'us_dollars_and_cents':
+        cent_places = 2 if arg is None else int(arg)
+        # Always show at least the cents
+        formatter = NumberFormatter(Decimal, max(0, cent_places), max(2, cent_places), u'$')
+    elif name == 'us_cents':
+        places = max(0, 1 if arg is None else int(arg))
+        formatter = CentsFormatter(float, places, places, suffix=u'\u00a2')
+    elif name == 'add_commas':
+        places = max(0, int(arg or 0))
+        formatter = NumberFormatter(decimal_from_str, places, places)
+    elif name == 'currency':
+        formatter = CurrencyFormatter(float, 2, 2, u'$')
+    else:
+        raise ValueError('Unknown number format %r' % name)
+    _number_formatters[key] = formatter
+    return formatter
+
+
 @register.filter
 def us_dollars(value):
     """
@@ -261,18 +567,7 @@ def us_dollars(value):
         if value = -20000
         {{ value|us_dollars }} => -$20,000
     """
-    # Try to convert to Decimal
-    try:
-        value = Decimal(value).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
-    except InvalidOperation as e:
-        if re.search('Invalid literal for Decimal', e[0]):
-            return FORMAT_TAG_ERROR_VALUE
-        else:
-            raise e
-    except TypeError:
-        return FORMAT_TAG_ERROR_VALUE
-    # Format as currency value
-    return locale.currency(value, grouping=True)[:-3]
+    return get_number_formatter('us_dollars')(value)
 
 
 @register.filter
@@ -289,28 +584,7 @@ def us_cents(value, places=1):
         # if value = 0.082
         {{ value|us_cents:3 }} => 0.082 \u00a2
     """
-    # Try to convert to float
-    try:
-        value = float(value)
-    except ValueError as e:
-        if re.search('invalid literal for float', e[0]):
-            return FORMAT_TAG_ERROR_VALUE
-        else:
-            raise e
-    except TypeError:
-        return FORMAT_TAG_ERROR_VALUE
-    # Require places >= 0
-    places = max(0, places)
-    # Get negative sign
-    sign = u'-' if value < 0 else u''
-    # Get formatted value
-    formatted = unicode(locale.format(
-        '%0.' + str(places) + 'f',
-        abs(value),
-        grouping=True,
-        ))
-    # Return value with sign and cents symbol
-    return sign + formatted + u'\u00a2'
+    return get_number_formatter('us_cents', places)(value)
 
 
 @register.filter
@@ -328,27 +602,7 @@ def us_dollars_and_cents(value, cent_places=2):
         # if value = 0.082  (8.2 cents)
         {{ value|us_dollars_and_cents:3 }} => $0.082
     """
-    # Try to convert to Decimal
-    try:
-        value = Decimal(value).quantize(Decimal('1.' + '0' * cent_places), rounding=ROUND_HALF_UP)
-    except InvalidOperation as e:
-        if re.search('Invalid literal for Decimal', e[0]):
-            return FORMAT_TAG_ERROR_VALUE
-        else:
-            raise e
-    except TypeError:
-        return FORMAT_TAG_ERROR_VALUE
-    # Require cent_places >= 2
-    if cent_places < 2:
-        cent_places = 2
-    # Get extra cent places if needed
-    if cent_places > 2:
-        extra_places = cent_places - 2
-        extra_places = str(value)[-extra_places:]
-    else:
-        extra_places = ''
-    # Format as currency value
-    return locale.currency(value, grouping=True) + extra_places
+    return get_number_formatter('us_dollars_and_cents', cent_places)(value)
 
 
 @register.filter
@@ -367,25 +621,37 @@ def add_commas(value, round=0):
         # if value = 1234.5678
         {{ value|add_commas:2 }} => 1,234.57
     """
-    # Decimals honor locale settings correctly
-    try:
-        value = Decimal(str(value))
-    except InvalidOperation as e:
-        if re.search('Invalid literal for Decimal', e[0]):
-            return FORMAT_TAG_ERROR_VALUE
-        else:
-            raise e
-    except TypeError:
-        return FORMAT_TAG_ERROR_VALUE
-    # Round the value
-    if round > 0:
-        format = Decimal('1.' + round * '0')
-    else:
-        format = Decimal('1')
-    value = value.quantize(format, rounding=ROUND_HALF_UP)
-    # Locale settings properly format Decimals with commas
-    # Super gross, but it works for both 2.6 and 2.7.
-    return locale.format("%." + str(round) + "f", value, grouping=True)
+    return get_number_formatter('add_commas', round)(value)
+
+
+def format_column(values, format='add_commas', arg=None):
+    """
+    Formats a whole sequence of numbers like the filter named ``format``
+    (``add_commas``, ``us_dollars``, ``us_dollars_and_cents``, ``us_cents``
+    or ``currency``) with the argument ``arg`` would, returning a list of
+    strings.  The rounding and format string are set up once for the whole
+    sequence.
+
+    NumPy arrays (anything with ``tolist()``) are converted to Python numbers
+    first, in one call.
+    """
+    formatter = get_number_formatter(format, arg)
+    if hasattr(values, 'tolist'):
+        values = values.tolist()
+    return [formatter(value) for value in values]
+
+
+@register.assignment_tag(name='format_column')
+def format_column_tag(values, format='add_commas', arg=None):
+    """
+    Formats a column of numbers at once, see :func:`format_column`::
+
+        {% format_column prices "us_dollars_and_cents" 3 as formatted_prices %}
+        {% for price in formatted_prices %}
+            <td>{{ price }}</td>
+        {% endfor %}
+    """
+    return format_column(values, format, arg)
 
 
 @register.filter
@@ -3,3 +3,5 @@ from test_behaviors import *
 from test_serializers import *
 from test_unicode_csv import *
 from test_middleware import *
+from test_rest import *
+from test_decorators import *
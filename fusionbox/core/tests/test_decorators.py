@@ -0,0 +1,97 @@
+import time
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from fusionbox.decorators import cached, invalidate_tags
+
+
+class TestCached(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def make(self, **kwargs):
+        @cached(lambda a: [str(a)], **kwargs)
+        def double(a):
+            self.calls.append(a)
+            return a * 2
+        return double
+
+    def test_cached(self):
+        double = self.make()
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(self.calls, [2])
+
+        double.clear_cache(2)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(self.calls, [2, 2])
+
+    def test_falsy(self):
+        @cached(lambda a: [str(a)])
+        def lookup(a):
+            self.calls.append(a)
+            return None if a else []
+
+        for i in range(2):
+            self.assertEqual(lookup(1), None)
+            self.assertEqual(lookup(0), [])
+        self.assertEqual(self.calls, [1, 0])
+
+    def test_local_cache(self):
+        double = self.make(local_timeout=60)
+        double(2)
+        cache.clear()
+        # still in the process' cache
+        self.assertEqual(double(2), 4)
+        self.assertEqual(self.calls, [2])
+
+        double.clear_cache(2)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(self.calls, [2, 2])
+
+    def test_many(self):
+        double = self.make()
+        double(1)
+        self.assertEqual(double.many([(1,), (2,), (3,), (2,)]), [2, 4, 6, 4])
+        self.assertEqual(sorted(self.calls), [1, 2, 3])
+        self.assertEqual(double(3), 6)
+        self.assertEqual(double.many([(4,), (5,)], threads=2), [8, 10])
+        self.assertEqual(sorted(self.calls), [1, 2, 3, 4, 5])
+
+    def test_tags(self):
+        @cached(lambda a, b: [str(a), str(b)], tags=lambda a, b: ['a:%s' % a, 'b:%s' % b])
+        def add(a, b):
+            self.calls.append((a, b))
+            return a + b
+
+        add(1, 1)
+        add(1, 2)
+        add(2, 2)
+        invalidate_tags('a:1')
+        self.assertEqual(add(1, 1), 2)
+        self.assertEqual(add(2, 2), 4)
+        self.assertEqual(add.many([(1, 2), (2, 2)]), [3, 4])
+        self.assertEqual(self.calls, [(1, 1), (1, 2), (2, 2), (1, 1), (1, 2)])
+
+        invalidate_tags('b:2', 'nothing')
+        self.assertEqual(add.many([(1, 1), (1, 2), (2, 2)]), [2, 3, 4])
+        self.assertEqual(self.calls[5:], [(1, 2), (2, 2)])
+
+    def test_grace(self):
+        concurrent = []
+
+        @cached(lambda a: [str(a)], timeout=0.05, grace=60)
+        def counter(a):
+            self.calls.append(a)
+            if len(self.calls) == 2:
+                # another caller, while this one recalculates
+                concurrent.append(counter(a))
+            return len(self.calls)
+
+        self.assertEqual(counter(1), 1)
+        time.sleep(0.1)
+        self.assertEqual(counter(1), 2)
+        self.assertEqual(concurrent, [1])
+        self.assertEqual(counter(1), 2)
@@ -1,6 +1,22 @@
+import os
+import datetime
+import shutil
+import tempfile
+import warnings
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseNotFound
 from django.test import TestCase
+from django.test.client import RequestFactory
 from django.test.utils import override_settings
 
+from fusionbox.middleware import (RedirectFallbackMiddleware, FileHitSink,
+                                  CacheHitSink, DatabaseHitSink, flush_all_hits,
+                                  get_missing_templates, build_template_index,
+                                  generic_template_finder_view,
+                                  GenericTemplateFinderMiddleware)
+
 
 class TestGenericTemplateFinderMiddleware(TestCase):
     @override_settings(APPEND_SLASH=False)
@@ -23,3 +39,201 @@ class TestGenericTemplateFinderMiddleware(TestCase):
 
         response = self.client.get('/blog/detail/')
         self.assertEqual(response.status_code, 200)
+
+    @override_settings(GENERIC_TEMPLATE_FINDER_MISSING_CACHE_SIZE=100)
+    def test_remembers_missing_templates(self):
+        response = self.client.get('/does-not-exist/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('does-not-exist.html', get_missing_templates())
+        self.assertIn('does-not-exist/index.html', get_missing_templates())
+
+    @override_settings(GENERIC_TEMPLATE_FINDER_MISSING_CACHE_SIZE=0)
+    def test_missing_templates_disabled(self):
+        self.assertIsNone(get_missing_templates())
+        response = self.client.get('/does-not-exist/')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestGenericTemplateFinderCache(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(GENERIC_TEMPLATE_FINDER_CACHE_TIMEOUT=60)
+    def test_conditional_get(self):
+        middleware = GenericTemplateFinderMiddleware()
+        factory = RequestFactory()
+        response = middleware.process_response(factory.get('/news/'), HttpResponseNotFound())
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        request = factory.get('/news/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(middleware.process_response(request, HttpResponseNotFound()).status_code, 304)
+        request = factory.get('/news/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(middleware.process_response(request, HttpResponseNotFound()).status_code, 304)
+        request = factory.get('/news/')
+        self.assertEqual(middleware.process_response(request, HttpResponseNotFound()).content, response.content)
+
+
+class TestTemplateIndex(TestCase):
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.template_dir, 'blog'))
+        for name in ('news.html', os.path.join('blog', 'index.html')):
+            open(os.path.join(self.template_dir, name), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.template_dir)
+
+    def test_build_template_index(self):
+        self.assertEqual(build_template_index([self.template_dir]),
+                         set(['news.html', 'blog/index.html']))
+
+    def test_view_only_tries_indexed_templates(self):
+        request = RequestFactory().get('/news/')
+        with self.assertRaises(Http404):
+            generic_template_finder_view(request, template_index=set(['blog/index.html']))
+
+
+class TestRedirectFallbackMiddlewareReload(TestCase):
+    def setUp(self):
+        self.redirect_path = tempfile.mkdtemp()
+        self.write('a.csv', '/foo/,/bar/\n', 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.redirect_path)
+
+    def write(self, filename, content, mtime):
+        path = os.path.join(self.redirect_path, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+
+    def test_reloads_changed_files(self):
+        with self.settings(REDIRECTS_DIRECTORY=self.redirect_path, REDIRECTS_RELOAD_INTERVAL=60):
+            middleware = RedirectFallbackMiddleware()
+            self.assertIsNone(middleware.redirects.match('/baz/'))
+
+            self.write('b.csv', '/baz/,/qux/\n', 2000)
+            middleware.reload_redirects()
+            self.assertEqual(middleware.redirects.match('/baz/')[1], '/qux/')
+            self.assertEqual(middleware.redirects.match('/foo/')[1], '/bar/')
+
+            # A circular redirect keeps the previous redirects in place.
+            self.write('b.csv', '/baz/,/qux/\n/qux/,/baz/\n', 3000)
+            with self.assertRaises(ImproperlyConfigured):
+                middleware.reload_redirects(raise_errors=True)
+            self.assertEqual(middleware.redirects.match('/baz/')[1], '/qux/')
+
+    def test_reload_without_files(self):
+        os.remove(os.path.join(self.redirect_path, 'a.csv'))
+        with self.settings(REDIRECTS_DIRECTORY=self.redirect_path, REDIRECTS_RELOAD_INTERVAL=60):
+            middleware = RedirectFallbackMiddleware()
+            self.assertIsNone(middleware.redirects.match('/foo/'))
+
+    def test_reload_without_raising_errors(self):
+        self.write('b.csv', '/baz/,/qux/\n/qux/,/baz/\n', 2000)
+        with self.settings(REDIRECTS_DIRECTORY=self.redirect_path, REDIRECTS_RELOAD_INTERVAL=60):
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                middleware = RedirectFallbackMiddleware(raise_errors=False)
+            self.assertTrue(any('Circular redirect' in str(warning.message) for warning in w))
+            self.assertEqual(middleware.redirects.match('/foo/')[1], '/bar/')
+
+
+class TestSiteHosts(TestCase):
+    def setUp(self):
+        self.redirect_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.redirect_path)
+
+    def test_site_changes_clear_hosts(self):
+        from django.contrib.sites.models import Site
+        from django.db.models import signals
+
+        with self.settings(REDIRECTS_DIRECTORY=self.redirect_path):
+            receivers = len(signals.post_save.receivers)
+            RedirectFallbackMiddleware()
+            RedirectFallbackMiddleware()
+            self.assertTrue(len(signals.post_save.receivers) <= receivers + 1)
+            middleware = RedirectFallbackMiddleware()
+
+        request = RequestFactory().get('/', HTTP_HOST='example.com')
+        self.assertTrue(middleware.is_current_site(request))
+        site = Site.objects.get_current()
+        site.domain = 'example.org'
+        site.save()
+        self.assertFalse(middleware.is_current_site(request))
+
+
+class TestFileHitSink(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_get_hits(self):
+        today = datetime.date.today()
+        sink = FileHitSink(self.path)
+        sink.flush({'/foo/': 2, '/bar/': 1}, today - datetime.timedelta(days=10))
+        sink.flush({'/foo/': 3}, today)
+        self.assertEqual(sink.get_hits(today), {'/foo/': 3})
+        self.assertEqual(sink.get_hits(today - datetime.timedelta(days=30)), {'/foo/': 5, '/bar/': 1})
+
+
+class TestCacheHitSink(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_hits(self):
+        today = datetime.date.today()
+        sink = CacheHitSink()
+        sink.flush({'/foo/': 2, '/bar/': 1}, today - datetime.timedelta(days=10))
+        sink.flush({'/foo/': 3}, today)
+        self.assertEqual(sink.get_hits(today), {'/foo/': 3})
+        self.assertEqual(sink.get_hits(today - datetime.timedelta(days=30)), {'/foo/': 5, '/bar/': 1})
+
+
+class TestDatabaseHitSink(TestCase):
+    def test_get_hits(self):
+        today = datetime.date.today()
+        sink = DatabaseHitSink()
+        sink.flush({'/foo/': 2, '/bar/': 1}, today - datetime.timedelta(days=10))
+        sink.flush({'/foo/': 3}, today)
+        sink.flush({'/foo/': 1}, today)
+        self.assertEqual(sink.get_hits(today), {'/foo/': 4})
+        self.assertEqual(sink.get_hits(today - datetime.timedelta(days=30)), {'/foo/': 6, '/bar/': 1})
+
+
+class TestPendingHits(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.redirect_path = tempfile.mkdtemp()
+        with open(os.path.join(self.redirect_path, 'a.csv'), 'w') as f:
+            f.write('/foo/,/bar/\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.redirect_path)
+
+    def test_flushes_pending_hits(self):
+        with self.settings(REDIRECTS_DIRECTORY=self.redirect_path,
+                           REDIRECTS_HIT_SINK='fusionbox.middleware.CacheHitSink',
+                           REDIRECTS_HIT_FLUSH_INTERVAL=60):
+            middleware = RedirectFallbackMiddleware()
+            response = middleware.process_response(RequestFactory().get('/foo/'), HttpResponseNotFound())
+            self.assertEqual(response.status_code, 301)
+            today = datetime.date.today()
+            self.assertEqual(CacheHitSink().get_hits(today), {})
+
+            # Flushed by a later request once the interval has passed...
+            middleware._last_hit_flush -= 60
+            middleware.process_response(RequestFactory().get('/other/'), HttpResponse())
+            self.assertEqual(CacheHitSink().get_hits(today), {'/foo/': 1})
+
+            # ...or when the process exits.
+            middleware.process_response(RequestFactory().get('/foo/'), HttpResponseNotFound())
+            flush_all_hits()
+            self.assertEqual(CacheHitSink().get_hits(today), {'/foo/': 2})
@@ -0,0 +1,212 @@
+import json
+import decimal
+import datetime
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.unittest import skipIf
+
+from fusionbox.core import serializers
+from fusionbox.core.serializers import FusionboxJSONEncoder, FORMATS, register_format, get_format, msgpack, cbor2
+from fusionbox.views.rest import RestView, get_accepted_type
+
+
+class ThingView(RestView):
+    version = '1'
+    modified = datetime.datetime(2013, 1, 1)
+    calls = 0
+
+    def auth(self, *args, **kwargs):
+        pass
+
+    def get_etag(self, request, *args, **kwargs):
+        return self.version
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return self.modified
+
+    def get(self, request, *args, **kwargs):
+        ThingView.calls += 1
+        return self.render_to_response({'name': 'thing'})
+
+
+class StreamingThingDetailView(ThingView):
+    streaming = True
+    weak_etag = True
+
+
+class WeakEtagView(RestView):
+    weak_etag = True
+
+    def auth(self, *args, **kwargs):
+        pass
+
+    def get(self, request, *args, **kwargs):
+        return self.render_to_response({'name': 'thing'})
+
+
+class TestRestViewConditional(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        ThingView.calls = 0
+
+    def test_etag(self):
+        response = ThingView.as_view()(self.factory.get('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {'name': 'thing'})
+
+        response = ThingView.as_view()(self.factory.get('/', HTTP_IF_NONE_MATCH='"0", W/"1"'))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(ThingView.calls, 1)
+
+        response = ThingView.as_view()(self.factory.get('/', HTTP_IF_NONE_MATCH='"0"'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_modified(self):
+        response = ThingView.as_view()(self.factory.get('/'))
+        last_modified = response['Last-Modified']
+
+        response = ThingView.as_view()(self.factory.get('/', HTTP_IF_MODIFIED_SINCE=last_modified))
+        self.assertEqual(response.status_code, 304)
+
+        response = ThingView.as_view()(self.factory.get('/', HTTP_IF_MODIFIED_SINCE='Mon, 31 Dec 2012 00:00:00 GMT'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_weak_etag(self):
+        response = WeakEtagView.as_view()(self.factory.get('/'))
+        self.assertTrue(response['ETag'].startswith('W/"'))
+
+        response = WeakEtagView.as_view()(self.factory.get('/', HTTP_IF_NONE_MATCH=response['ETag']))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_streaming(self):
+        response = StreamingThingDetailView.as_view()(self.factory.get('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(response['Last-Modified'], 'Tue, 01 Jan 2013 00:00:00 GMT')
+        self.assertEqual(json.loads(b''.join(response).decode('utf-8')), {'name': 'thing'})
+
+        response = StreamingThingDetailView.as_view()(self.factory.get('/', HTTP_IF_NONE_MATCH='"1"'))
+        self.assertEqual(response.status_code, 304)
+
+
+class Thing(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def to_json(self):
+        return self.__dict__
+
+
+class ThingListView(RestView):
+    def auth(self, *args, **kwargs):
+        pass
+
+    def get(self, request, *args, **kwargs):
+        return self.render_to_response([Thing(a=1, b=2, c=3), {'a': 4, 'd': 5}])
+
+
+class TestRestViewFields(TestCase):
+    def get(self, view, url):
+        response = view.as_view()(RequestFactory().get(url))
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_fields(self):
+        self.assertEqual(self.get(ThingListView, '/?fields=a,c'), [{'a': 1, 'c': 3}, {'a': 4}])
+        self.assertEqual(self.get(ThingListView, '/'), [{'a': 1, 'b': 2, 'c': 3}, {'a': 4, 'd': 5}])
+
+    def test_queryset_values(self):
+        try:
+            from django.contrib.auth import get_user_model
+            User = get_user_model()
+        except ImportError:
+            from django.contrib.auth.models import User  # NOQA
+        user = User.objects.create(username='bob', email='bob@example.com')
+
+        class UserView(ThingListView):
+            def get(self, request, *args, **kwargs):
+                return self.render_to_response(User.objects.all())
+
+        # User has no to_json, so it can only be serialized through values()
+
+        self.assertEqual(self.get(UserView, '/?fields=username,nope'), [{'username': 'bob'}])
+
+        handlers = dict(FusionboxJSONEncoder.handlers)
+        model_fields = dict(FusionboxJSONEncoder.model_fields)
+        FusionboxJSONEncoder.register_model(User, ['id', 'username', 'email'])
+        try:
+            self.assertEqual(self.get(UserView, '/?fields=username'), [{'username': 'bob'}])
+            self.assertEqual(self.get(UserView, '/?fields=password'), [{}])
+            self.assertEqual(self.get(UserView, '/'), [
+                {'id': user.pk, 'username': 'bob', 'email': 'bob@example.com'},
+            ])
+        finally:
+            FusionboxJSONEncoder.handlers = handlers
+            FusionboxJSONEncoder.model_fields = model_fields
+            serializers._handler_cache.clear()
+
+
+class EchoView(ThingListView):
+    def post(self, request, *args, **kwargs):
+        return self.render_to_response(self.data())
+
+
+class TestRestViewNegotiation(TestCase):
+    def test_accept(self):
+        self.assertEqual(get_accepted_type(''), 'application/json')
+        self.assertEqual(get_accepted_type('text/html,*/*;q=0.8'), 'application/json')
+        self.assertEqual(get_accepted_type('application/x-unknown'), 'application/json')
+
+        register_format('application/x-test', repr, lambda data: data.decode('utf-8'))
+        try:
+            self.assertEqual(get_accepted_type('application/json;q=0.5, application/x-test'), 'application/x-test')
+            self.assertEqual(get_accepted_type('application/json, application/x-test;q=0.5'), 'application/json')
+
+            response = ThingListView.as_view()(RequestFactory().get('/', HTTP_ACCEPT='application/x-test'))
+            self.assertEqual(response['Content-Type'], 'application/x-test')
+            self.assertIn('Accept', response['Vary'])
+
+            request = RequestFactory().post('/', b'data', content_type='application/x-test')
+            response = EchoView.as_view()(request)
+            self.assertEqual(json.loads(response.content.decode('utf-8')), 'data')
+        finally:
+            del FORMATS['application/x-test']
+
+    def test_data(self):
+        request = RequestFactory().post('/', '{"a": [1]}', content_type='application/json; charset=utf-8')
+        response = EchoView.as_view()(request)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {'a': [1]})
+
+
+class StreamingThingView(ThingListView):
+    streaming = True
+
+    def get(self, request, *args, **kwargs):
+        things = (Thing(a=i, b=decimal.Decimal('1.5'), c=datetime.date(2013, 1, i + 1)) for i in range(2))
+        return self.render_to_response(things)
+
+
+class TestRestViewBinaryFormats(TestCase):
+    def get(self, content_type, url='/'):
+        request = RequestFactory().get(url, HTTP_ACCEPT=content_type)
+        response = StreamingThingView.as_view()(request)
+        self.assertEqual(response['Content-Type'], content_type)
+        return get_format(content_type)[1](response.content)
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        self.assertEqual(self.get('application/msgpack'), [
+            {'a': 0, 'b': '1.5', 'c': '2013-01-01'},
+            {'a': 1, 'b': '1.5', 'c': '2013-01-02'},
+        ])
+        self.assertEqual(self.get('application/msgpack', '/?fields=a'), [{'a': 0}, {'a': 1}])
+
+    @skipIf(cbor2 is None, 'cbor2 is not installed')
+    def test_cbor(self):
+        self.assertEqual(self.get('application/cbor'), [
+            {'a': 0, 'b': decimal.Decimal('1.5'), 'c': datetime.date(2013, 1, 1)},
+            {'a': 1, 'b': decimal.Decimal('1.5'), 'c': datetime.date(2013, 1, 2)},
+        ])
+        self.assertEqual(self.get('application/cbor', '/?fields=a'), [{'a': 0}, {'a': 1}])
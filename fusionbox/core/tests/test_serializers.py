@@ -3,8 +3,10 @@ import datetime
 import decimal
 
 from django.utils import unittest
+from django.utils.functional import SimpleLazyObject
 
-from fusionbox.core.serializers import FusionboxJSONEncoder
+from fusionbox.core import serializers
+from fusionbox.core.serializers import FusionboxJSONEncoder, dumps, escape_html, stream
 
 
 class TestObject(object):
@@ -33,6 +35,17 @@ class TestJson(unittest.TestCase):
         self.assertion(decimal.Decimal('1.1'), '1.1')
         self.assertIn('2012-10-16', self.encode_and_decode(datetime.datetime(2012, 10, 16)))
 
+    def test_instance_to_json(self):
+        self.assertion(SimpleLazyObject(lambda: TestObject('lazy')), 'lazy')
+
+        class Plain(object):
+            pass
+        o = Plain()
+        o.to_json = lambda: 'instance'
+        self.assertion(o, 'instance')
+        with self.assertRaises(TypeError):
+            json.dumps(Plain(), cls=FusionboxJSONEncoder)
+
     def test_queryset(self):
         try:
             from django.contrib.auth import get_user_model
@@ -40,3 +53,98 @@ class TestJson(unittest.TestCase):
         except ImportError:
             from django.contrib.auth.models import User  # NOQA
         self.assertion(User.objects.filter(id=None), [])
+        self.assertEqual(''.join(stream(User.objects.filter(id=None))), '[]')
+
+    def test_register(self):
+        class Encoder(FusionboxJSONEncoder):
+            pass
+
+        class SubObject(TestObject):
+            pass
+
+        Encoder.register(TestObject, lambda o: {'value': o.value})
+        self.assertEqual(json.loads(json.dumps(SubObject(1), cls=Encoder)), {'value': 1})
+        # The base encoder's registry is untouched.
+        self.assertion(SubObject(1), 1)
+        self.assertNotIn(TestObject, FusionboxJSONEncoder.handlers)
+
+    def test_register_model(self):
+        from django.contrib.auth.models import Permission
+
+        class Encoder(FusionboxJSONEncoder):
+            pass
+
+        Encoder.register_model(Permission, ['pk', 'codename', 'content_type'])
+        permission = Permission(pk=1, codename='add_thing', content_type_id=2)
+        # Foreign keys are encoded as their pk, like values() returns them
+        self.assertEqual(json.loads(json.dumps(permission, cls=Encoder)),
+                         {'pk': 1, 'codename': 'add_thing', 'content_type': 2})
+
+    def test_dumps(self):
+        value = [TestObject({'a': decimal.Decimal('1.1')}), datetime.datetime(2012, 10, 16), 2 ** 70]
+        self.assertEqual(json.loads(dumps(value)), self.encode_and_decode(value))
+        self.assertEqual(dumps({'a': 1}, indent=4), json.dumps({'a': 1}, indent=4))
+
+    def test_stream(self):
+        value = {'a': [TestObject((1, 2)), None, 'b'], 1: decimal.Decimal('1.1'), 'c': {}}
+        self.assertEqual(json.loads(''.join(stream(value))), self.encode_and_decode(value))
+
+        # Only the parts around an iterator are produced piece by piece
+        chunks = list(stream({'a': iter(range(250)), 'b': [TestObject(iter([1]))]}, chunk_size=1))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(json.loads(''.join(chunks)), {'a': list(range(250)), 'b': [[1]]})
+
+    def test_stream_iterators(self):
+        def rows():
+            for i in range(3):
+                yield {'i': i, 'squares': (j * j for j in range(i))}
+        self.assertEqual(json.loads(''.join(stream(rows()))), [
+            {'i': 0, 'squares': []},
+            {'i': 1, 'squares': [0]},
+            {'i': 2, 'squares': [0, 1]},
+        ])
+        self.assertEqual(''.join(stream(iter([]))), '[]')
+
+    def test_stream_circular(self):
+        value = {'a': []}
+        value['a'].append(value)
+        with self.assertRaises(ValueError):
+            list(stream(value))
+        with self.assertRaises(ValueError):
+            list(stream([TestObject(value)]))
+
+        shared = [1]
+        self.assertEqual(json.loads(''.join(stream([shared, shared]))), [[1], [1]])
+
+    def test_dumps_ascii(self):
+        value = {u'k\xe9': [u'\u2028\u2029', u'\U0001f600', 1.5, None]}
+        expected = json.dumps(value, separators=(',', ':'))
+        self.assertEqual(dumps(value), expected)
+        orjson = serializers.orjson
+        serializers.orjson = None
+        try:
+            self.assertEqual(dumps(value), expected)
+        finally:
+            serializers.orjson = orjson
+
+    def test_escape_html(self):
+        json_str = escape_html(dumps('</script><b>&amp;'))
+        self.assertNotIn('<', json_str)
+        self.assertNotIn('>', json_str)
+        self.assertNotIn('&', json_str)
+        self.assertEqual(json.loads(json_str), '</script><b>&amp;')
+
+        json_str = escape_html(json.dumps(u'\u2028\u2029', ensure_ascii=False))
+        self.assertEqual(json_str, '"\\u2028\\u2029"')
+
+    def test_dumps_html_safe(self):
+        value = {u'</k\xe9>': [u'&\u2028\u2029', u'\U0001f600']}
+        expected = escape_html(json.dumps(value, separators=(',', ':')))
+        self.assertNotIn('<', expected)
+        self.assertEqual(dumps(value, html_safe=True), expected)
+        orjson = serializers.orjson
+        serializers.orjson = None
+        try:
+            self.assertEqual(dumps(value, html_safe=True), expected)
+        finally:
+            serializers.orjson = orjson
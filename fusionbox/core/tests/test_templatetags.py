@@ -1,11 +1,25 @@
 from django.utils import unittest
 from django.test import SimpleTestCase
+from django.test.utils import override_settings
 from django.template import Template, Context, TemplateSyntaxError
 from django.http import HttpRequest as Request
 from django.core.exceptions import ImproperlyConfigured
+import os
+import tempfile
 import warnings
 
-from fusionbox.middleware import get_redirect, preprocess_redirects
+from mock import patch
+
+numpy = None
+try:
+    import numpy
+except ImportError:
+    pass
+
+from fusionbox.middleware import get_redirect, preprocess_redirects, RedirectTable
+from fusionbox.core.templatetags.fusionbox_tags import (
+    us_dollars, us_dollars_and_cents, us_cents, add_commas, currency, format_column,
+    FORMAT_TAG_ERROR_VALUE, HighlightHereNode, get_highlight_cache)
 
 class TestObject(object):
     """
@@ -125,6 +139,51 @@ class TestRandomTags(SimpleTestCase):
         print "Goodbye First: %s" % goodbye_count
         print "----------"
 
+class TestNumberFilters(unittest.TestCase):
+    def test_us_dollars(self):
+        self.assertEqual(us_dollars(-20000), '-$20,000')
+        self.assertEqual(us_dollars('1234.5'), '$1,235')
+        self.assertEqual(us_dollars('abc'), FORMAT_TAG_ERROR_VALUE)
+
+    def test_us_dollars_and_cents(self):
+        self.assertEqual(us_dollars_and_cents(-20000.125), '-$20,000.13')
+        self.assertEqual(us_dollars_and_cents(0.082, 3), '$0.082')
+        self.assertEqual(us_dollars_and_cents('-0.001'), '$0.00')
+        self.assertEqual(us_dollars_and_cents(None), FORMAT_TAG_ERROR_VALUE)
+
+    def test_us_cents(self):
+        self.assertEqual(us_cents(-20.125), u'-20.1\u00a2')
+        self.assertEqual(us_cents(1234567.25, 2), u'1,234,567.25\u00a2')
+        self.assertEqual(us_cents('abc'), FORMAT_TAG_ERROR_VALUE)
+
+    def test_add_commas(self):
+        self.assertEqual(add_commas(20000), '20,000')
+        self.assertEqual(add_commas(20000, 3), '20,000.000')
+        self.assertEqual(add_commas(1234.5678, 2), '1,234.57')
+        self.assertEqual(add_commas(-1234567.891, 1), '-1,234,567.9')
+        self.assertEqual(add_commas('nan'), FORMAT_TAG_ERROR_VALUE)
+
+    def test_format_column(self):
+        self.assertEqual(format_column([1234.5, 'abc', -0.001], 'us_dollars_and_cents'),
+                         ['$1,234.50', FORMAT_TAG_ERROR_VALUE, '$0.00'])
+        self.assertEqual(format_column([20000, 1234.5678], 'add_commas', 2),
+                         [add_commas(20000, 2), add_commas(1234.5678, 2)])
+        self.assertEqual(format_column([1.999, -1234.567], 'currency'),
+                         [currency(1.999), '$-1,234.57'])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_format_column_numpy(self):
+        self.assertEqual(format_column(numpy.array([20000, -3]), 'us_dollars'), ['$20,000', '-$3'])
+        self.assertEqual(format_column(numpy.array([1234.5678, 2.675]), 'add_commas', 2),
+                         [add_commas(1234.5678, 2), add_commas(2.675, 2)])
+
+    def test_format_column_tag(self):
+        t = Template('{% load fusionbox_tags %}'
+                     '{% format_column values "us_dollars" as formatted %}'
+                     '{% for value in formatted %}<td>{{ value }}</td>{% endfor %}')
+        self.assertEqual('<td>$1,000</td><td>-$3</td>', t.render(Context({'values': [1000, -2.5]})))
+
+
 class TestHighlightHereTags(unittest.TestCase):
     request = Request()
 
@@ -210,6 +269,41 @@ class TestHighlightHereTags(unittest.TestCase):
                          '<a class="blog here" href="/blog/">Blog</a>'
                          '<a class="blog here" href="/blog/detail/foo/">Blog detail</a>', t.render(c))
 
+    def test_highlight_here_dynamic_content(self):
+        t = Template('{% load fusionbox_tags %}'
+                     '{% highlight_here %}'
+                     '{% for url in urls %}<a href="{{ url }}">{{ url }}</a>{% endfor %}'
+                     '<!-- <a href="/blog/">Blog</a> -->'
+                     '{% endhighlight %}'
+                    )
+        self.request.path = '/blog/'
+        c = Context({'request':self.request, 'urls': ['/', '/blog/']})
+        self.assertEqual('<a href="/">/</a>'
+                         '<a href="/blog/" class="here">/blog/</a>'
+                         '<!-- <a href="/blog/">Blog</a> -->', t.render(c))
+
+    @override_settings(HIGHLIGHT_HERE_CACHE_SIZE=10)
+    def test_highlight_here_cache(self):
+        t = Template('{% load fusionbox_tags %}'
+                     '{% highlight_here %}'
+                     '<a href="/">Index</a>'
+                     '<a href="/blog/">Blog</a>'
+                     '{% endhighlight %}'
+                    )
+        for i in range(2):
+            self.request.path = '/blog/'
+            self.assertEqual('<a href="/">Index</a>'
+                             '<a href="/blog/" class="here">Blog</a>', t.render(Context({'request':self.request})))
+            self.request.path = '/'
+            self.assertEqual('<a href="/" class="here">Index</a>'
+                             '<a href="/blog/">Blog</a>', t.render(Context({'request':self.request})))
+        self.assertEqual(len(get_highlight_cache()), 2)
+
+        with patch.object(HighlightHereNode, 'highlight_content') as highlight_content:
+            self.assertEqual('<a href="/" class="here">Index</a>'
+                             '<a href="/blog/">Blog</a>', t.render(Context({'request':self.request})))
+            self.assertFalse(highlight_content.called)
+
 class TestHighlightParentTags(unittest.TestCase):
     request = Request()
 
@@ -415,3 +509,108 @@ class TestRedirectMiddleware(unittest.TestCase):
                 {'source': 'http://www.fusionbox.com/bar/', 'target': 'http://www.google.com/bar/', 'status_code': None, 'filename': '', 'line_number':1},
             )
         preprocess_redirects(redirects)
+
+    def test_prefix_redirect(self):
+        redirects = (
+                {'source': '/old-blog/*', 'target': '/blog/*', 'status_code': None, 'filename': '', 'line_number':1},
+                {'source': '/old-blog/archive/*', 'target': '/archive/', 'status_code': 302, 'filename': '', 'line_number':2},
+            )
+        redirects = preprocess_redirects(redirects)
+        response = get_redirect(redirects, '/old-blog/2012/post/', '')
+        self.assertEqual(response['Location'], '/blog/2012/post/')
+        self.assertEqual(response.status_code, 301)
+        response = get_redirect(redirects, '/old-blog/archive/2012/', '')
+        self.assertEqual(response['Location'], '/archive/')
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(get_redirect(redirects, '/blog/2012/post/', ''))
+
+    def test_pattern_redirect(self):
+        redirects = (
+                {'source': r'^/products/(\d+)/$', 'target': r'/p/\1/', 'status_code': None, 'filename': '', 'line_number':1},
+                {'source': r'^/shop/(?P<slug>[\w-]+)/$', 'target': r'/store/\g<slug>/', 'status_code': None, 'filename': '', 'line_number':2},
+            )
+        redirects = preprocess_redirects(redirects)
+        self.assertEqual(get_redirect(redirects, '/products/12/', '')['Location'], '/p/12/')
+        self.assertEqual(get_redirect(redirects, '/shop/a-hat/', '')['Location'], '/store/a-hat/')
+        self.assertIsNone(get_redirect(redirects, '/products/abc/', ''))
+
+    def test_pattern_redirect_backreference(self):
+        redirects = (
+                {'source': r'^/x/(\d+)/$', 'target': r'/y/\1/', 'status_code': None, 'filename': '', 'line_number':1},
+                {'source': r'^/(\w+)/\1/$', 'target': r'/double/\1/', 'status_code': None, 'filename': '', 'line_number':2},
+                {'source': r'^/(a/)?b(?(1)c|d)/$', 'target': '/cond/', 'status_code': None, 'filename': '', 'line_number':3},
+                {'source': r'^/z/(\d+)/$', 'target': r'/w/\1/', 'status_code': None, 'filename': '', 'line_number':4},
+            )
+        redirects = preprocess_redirects(redirects)
+        self.assertEqual(get_redirect(redirects, '/x/1/', '')['Location'], '/y/1/')
+        self.assertEqual(get_redirect(redirects, '/ab/ab/', '')['Location'], '/double/ab/')
+        self.assertIsNone(get_redirect(redirects, '/ab/cd/', ''))
+        self.assertEqual(get_redirect(redirects, '/a/bc/', '')['Location'], '/cond/')
+        self.assertEqual(get_redirect(redirects, '/bd/', '')['Location'], '/cond/')
+        self.assertEqual(get_redirect(redirects, '/z/2/', '')['Location'], '/w/2/')
+
+    def test_invalid_pattern_redirect(self):
+        redirects = (
+                {'source': '^/products/(', 'target': '/p/', 'status_code': None, 'filename': '', 'line_number':1},
+            )
+        with self.assertRaises(ImproperlyConfigured):
+            preprocess_redirects(redirects)
+
+    def test_compiled_redirect_table(self):
+        redirects = (
+                {'source': '/bar/', 'target': None, 'status_code': None, 'filename': '', 'line_number':1},
+                {'source': '/old-blog/*', 'target': '/blog/*', 'status_code': None, 'filename': '', 'line_number':2},
+            )
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            RedirectTable.write(path, list(self.redirects.values()) + list(preprocess_redirects(redirects).values()))
+            table = RedirectTable(path)
+            response = get_redirect(table, '/foo/302/', '')
+            self.assertEqual(response['Location'], '/bar/')
+            self.assertEqual(response.status_code, 302)
+            response = get_redirect(table, '/asdf/', 'http://www.fusionbox.com/asdf/')
+            self.assertEqual(response['Location'], '/foo/bar/')
+            self.assertEqual(get_redirect(table, '/bar/', '').status_code, 410)
+            self.assertEqual(get_redirect(table, '/old-blog/a/', '')['Location'], '/blog/a/')
+            self.assertIsNone(get_redirect(table, '/baz/', ''))
+        finally:
+            os.unlink(path)
+
+    def test_long_circular_redirect(self):
+        redirects = (
+                {'source': '/a/', 'target': '/b/', 'status_code': None, 'filename': '', 'line_number':1},
+                {'source': '/b/', 'target': '/c/', 'status_code': None, 'filename': '', 'line_number':2},
+                {'source': '/c/', 'target': '/d', 'status_code': None, 'filename': '', 'line_number':3},
+                {'source': '/d/', 'target': '/a/', 'status_code': None, 'filename': '', 'line_number':4},
+            )
+        with self.assertRaises(ImproperlyConfigured):
+            preprocess_redirects(redirects, collapse_chains=True)
+
+    def test_collapse_redirect_chains(self):
+        redirects = (
+                {'source': '/a/', 'target': '/b/', 'status_code': None, 'filename': '', 'line_number':1},
+                {'source': '/b/', 'target': '/c/', 'status_code': None, 'filename': '', 'line_number':2},
+                {'source': '/c/', 'target': '/d/', 'status_code': 302, 'filename': '', 'line_number':3},
+                {'source': '/x/', 'target': '/c/', 'status_code': 302, 'filename': '', 'line_number':4},
+                {'source': '/gone/', 'target': '/old/', 'status_code': None, 'filename': '', 'line_number':5},
+                {'source': '/old/', 'target': None, 'status_code': None, 'filename': '', 'line_number':6},
+            )
+        with warnings.catch_warnings(record=True):
+            redirects = preprocess_redirects(redirects, collapse_chains=True)
+        self.assertEqual(redirects['/a/'].target, '/d/')
+        self.assertEqual(redirects['/a/'].status_code, 302)
+        self.assertEqual(redirects['/b/'].target, '/d/')
+        # Temporary redirects are not skipped
+        self.assertEqual(redirects['/x/'].target, '/c/')
+        self.assertEqual(redirects['/gone/'].status_code, 410)
+
+    def test_redirect_on_other_domain(self):
+        self.assertIsNone(get_redirect(self.redirects, '/asdf/', 'http://www.example.com/asdf/'))
+        redirects = (
+                {'source': '/asdf/', 'target': '/any/', 'status_code': None, 'filename': '', 'line_number':1},
+                {'source': 'http://www.fusionbox.com/asdf/', 'target': '/fusionbox/', 'status_code': None, 'filename': '', 'line_number':2},
+            )
+        redirects = preprocess_redirects(redirects)
+        self.assertEqual(get_redirect(redirects, '/asdf/', 'http://www.example.com/asdf/')['Location'], '/any/')
+        self.assertEqual(get_redirect(redirects, '/asdf/', 'https://www.fusionbox.com/asdf/')['Location'], '/fusionbox/')
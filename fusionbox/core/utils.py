@@ -1,3 +1,12 @@
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python 2.6
+    from ordereddict import OrderedDict
+
 from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
 
@@ -39,3 +48,104 @@ except ImportError:
         args_safe = map(conditional_escape, args)
         kwargs_safe = dict([(k, conditional_escape(v)) for (k, v) in kwargs.iteritems()])
         return mark_safe(format_string.format(*args_safe, **kwargs_safe))
+
+
+_quantize_exponents = {}
+
+
+def quantize_half_up(value, places):
+    """
+    Rounds the Decimal ``value`` to ``places`` decimal places, rounding
+    halves up.
+    """
+    try:
+        exponent = _quantize_exponents[places]
+    except KeyError:
+        exponent = _quantize_exponents[places] = Decimal(1).scaleb(-places)
+    return value.quantize(exponent, rounding=ROUND_HALF_UP)
+
+
+def format_number(value, places, prefix=u'', suffix=u''):
+    """
+    Formats ``value`` (a Decimal, float or int) with ``places`` decimal places
+    and commas between groups of thousands, the way the ``en_US`` locale
+    does, without using the ``locale`` module.  ``locale.setlocale`` changes
+    the whole process and is not thread safe.
+
+    The sign goes in front of the prefix::
+
+        >>> format_number(Decimal('-1234.5'), 2, u'$')
+        u'-$1,234.50'
+
+    Decimals are rounded the way they would be by ``str.format``, use
+    :func:`quantize_half_up` first for commercial rounding.
+    """
+    if value < 0:
+        sign = u'-'
+        value = -value
+    else:
+        sign = u''
+        # abs() drops the sign of negative zero
+        value = abs(value)
+    # The ',' format option is python >= 2.7, so the digits are grouped here.
+    integer, point, fraction = u'{0:.{1}f}'.format(value, places).partition(u'.')
+    head = len(integer) % 3 or 3
+    groups = [integer[:head]]
+    groups.extend(integer[i:i + 3] for i in range(head, len(integer), 3))
+    return sign + prefix + u','.join(groups) + point + fraction + suffix
+
+
+_missing = object()
+
+
+class LRUCache(object):
+    """
+    A thread safe, in-process dictionary holding at most ``max_size`` items,
+    discarding the least recently used ones first.  If ``timeout`` is given,
+    items also expire that many seconds after they were set.
+
+    ::
+
+        cache = LRUCache(1000, timeout=60)
+        cache.set('key', 'value')
+        cache.get('key')  # 'value'
+    """
+    def __init__(self, max_size, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                return default
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
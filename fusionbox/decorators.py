@@ -6,13 +6,23 @@ import json
 import re
 import six
 
+from collections import namedtuple
 from functools import wraps
+from multiprocessing.pool import ThreadPool
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python 2.6
+    from ordereddict import OrderedDict
 
 from django.conf import settings
 from django.views.decorators.http import require_http_methods
 from django.http import HttpResponseBadRequest
 from django.core.cache import cache
 
+from fusionbox.core.utils import LRUCache
+
 logger = logging.getLogger(__name__)
 
 
@@ -131,11 +141,81 @@ def args_kwargs_to_call(args, kwargs):
 
 WHITESPACE_RE = re.compile('\s')
 
-def cached(keyfn, timeout=300):
+
+def total_seconds(td):
+    # td.total_seconds()  # python >= 2.7
+    return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / float(10**6)
+
+
+def make_cache_key(key):
+    if WHITESPACE_RE.search(key):
+        # memcache doesn't allow whitespace in keys
+        return 'sha256:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+    else:
+        return 'raw:' + key
+
+
+# How cached() stores values, so None and other falsy results can be told
+# apart from a miss.  ``stale_at`` is the time the value expires (before any
+# grace period), ``duration`` how long it took to calculate and
+# ``generations`` the generations of its tags when it was calculated.
+CachedValue = namedtuple('CachedValue', ['value', 'stale_at', 'duration', 'generations'])
+CachedValue.__new__.__defaults__ = (None,)
+
+
+# How long tag counters are kept.  Passing None for "forever" only works on
+# Django >= 1.6 (earlier versions use the default timeout instead), and a
+# counter that expires is recreated with a new generation anyway.
+TAG_TIMEOUT = 60 * 60 * 24 * 365
+
+
+def tag_cache_key(tag):
+    return make_cache_key('tag:' + tag)
+
+
+def new_generation():
+    # Not 0, so that a counter that was evicted and recreated can't match the
+    # generations stored with older values.
+    return int(time.time() * 10**6)
+
+
+def get_generations(tag_keys, fetched):
+    """
+    Returns the current generations of the tag counters at ``tag_keys``,
+    taking them from ``fetched`` (the result of a ``get_many``) if present and
+    creating the missing ones.
+    """
+    generations = []
+    for key in tag_keys:
+        generation = fetched.get(key)
+        if generation is None:
+            generation = new_generation()
+            if not cache.add(key, generation, TAG_TIMEOUT):
+                generation = cache.get(key, generation)
+            fetched[key] = generation
+        generations.append(generation)
+    return tuple(generations)
+
+
+def invalidate_tags(*tags):
+    """
+    Invalidates every value cached by a function decorated with ``cached``
+    whose ``tags`` included any of ``tags``.
+    """
+    for tag in tags:
+        try:
+            cache.incr(tag_cache_key(tag))
+        except ValueError:
+            # There's no counter, so nothing cached under it is current.
+            pass
+
+
+def cached(keyfn, timeout=300, grace=None, local_timeout=None, local_max_size=1000, tags=None):
     """
     Returns a decorator that caches a function's return valued based on the
     keyfn applied to the inner function's arguments. The result is cached for
-    `timeout` seconds, or `timeout` timedelta.
+    `timeout` seconds, or `timeout` timedelta.  Any result is cached, including
+    ``None``.
 
     ::
 
@@ -152,28 +232,123 @@ def cached(keyfn, timeout=300):
         @cached(lambda self, a: [self.id, a])
         def whatever(self, a):
             # ...
+
+    If `grace` (seconds or a timedelta) is given, values are kept for that
+    much longer than `timeout`.  When a value is past `timeout`, the first
+    caller takes a lock (with ``cache.add``) and recalculates it, and the
+    callers that come in meanwhile get the stale value instead of all
+    recalculating at once.  The lock expires after `grace` seconds in case
+    that caller dies.
+
+    If `local_timeout` is given, values are also kept in an in-process LRU
+    cache of `local_max_size` items for that many seconds, which saves the
+    round trip to the cache backend for values that are read very often.
+    ``clear_cache`` and ``refresh`` update it immediately in the calling
+    process, other processes see the change within `local_timeout`.
+
+    `tags` is called with the function's arguments and returns a list of
+    strings that the value depends on.  ``invalidate_tags`` invalidates every
+    value cached with any of those tags, whatever their arguments::
+
+        @cached(lambda a, b, date: [str(a), str(b), date.isoformat()],
+                tags=lambda a, b, date: ['client:%s' % a, 'client:%s' % b])
+        def generate_report(a, b, date):
+            # ...
+
+        invalidate_tags('client:%s' % client.pk)
+
+    Each tag is a counter in the cache, which is read along with the value.
+
+    To look up many argument combinations at once, use ``many``, which reads
+    and writes the cache backend with ``get_many`` and ``set_many``::
+
+        reports = generate_report.many([(a, b, date) for a, b in pairs])
     """
 
     if isinstance(timeout, datetime.timedelta):
-        # timeout = timeout.total_seconds()  # python >= 2.7
-        timeout = (timeout.microseconds + (timeout.seconds + timeout.days * 24 * 3600) * 10**6) / float(10**6)
+        timeout = total_seconds(timeout)
+    if isinstance(grace, datetime.timedelta):
+        grace = total_seconds(grace)
+    if isinstance(local_timeout, datetime.timedelta):
+        local_timeout = total_seconds(local_timeout)
     def decorator(fn):
+        local_cache = None
+        if local_timeout is not None:
+            local_cache = LRUCache(local_max_size, timeout=local_timeout)
+
+        if grace is None or timeout is None:
+            backend_timeout = timeout
+        else:
+            backend_timeout = timeout + grace
+
         def cache_key(args, kwargs):
             key = [fn.__name__] + list(keyfn(*args, **kwargs))
-            key = ':'.join(key)
-            if WHITESPACE_RE.search(key):
-                # memcache doesn't allow whitespace in keys
-                return 'sha256:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
-            else:
-                return 'raw:' + key
+            return make_cache_key(':'.join(key))
 
-        def calculate_and_set(key, args, kwargs):
+        def tag_keys(args, kwargs):
+            if tags is None:
+                return []
+            return [tag_cache_key(tag) for tag in tags(*args, **kwargs)]
+
+        def fetch(keys, tag_keys):
+            """
+            Returns a dict of the CachedValues found for ``keys``, and of the
+            tag generations at ``tag_keys``, reading the backend only once.
+            """
+            entries = {}
+            if local_cache is not None:
+                for key in keys:
+                    entry = local_cache.get(key)
+                    if entry is not None:
+                        entries[key] = entry
+            missing = [key for key in keys if key not in entries]
+            if not missing and not tag_keys:
+                return entries
+            elif len(missing) == 1 and not tag_keys:
+                fetched = {missing[0]: cache.get(missing[0])}
+            else:
+                fetched = cache.get_many(missing + tag_keys)
+            for key in missing:
+                entry = fetched.get(key)
+                if isinstance(entry, CachedValue):
+                    entries[key] = entry
+                    if local_cache is not None:
+                        local_cache.set(key, entry)
+            for key in tag_keys:
+                if key in fetched:
+                    entries[key] = fetched[key]
+            return entries
+
+        def calculate(args, kwargs, generations):
             start = time.time()
             r = fn(*args, **kwargs)
             end = time.time()
             logger.info("%s(%s) took %s" % (fn.__name__, args_kwargs_to_call(args, kwargs), end - start))
-            cache.set(key, r, timeout)
-            return r
+            stale_at = None if timeout is None else end + timeout
+            return CachedValue(r, stale_at, end - start, generations)
+
+        def calculate_and_set(key, args, kwargs, generations):
+            entry = calculate(args, kwargs, generations)
+            cache.set(key, entry, backend_timeout)
+            if local_cache is not None:
+                local_cache.set(key, entry)
+            return entry.value
+
+        def is_current(entry, generations):
+            return entry is not None and entry.generations == generations
+
+        def is_stale(entry):
+            return grace is not None and entry.stale_at is not None and time.time() >= entry.stale_at
+
+        def recalculate_stale(key, value, args, kwargs, generations):
+            lock_key = key + ':lock'
+            if not cache.add(lock_key, 1, grace):
+                logger.info("%s(%s) is being recalculated, using the stale value" % (fn.__name__, args_kwargs_to_call(args, kwargs)))
+                return value
+            try:
+                return calculate_and_set(key, args, kwargs, generations)
+            finally:
+                cache.delete(lock_key)
 
         @wraps(fn)
         def refresh(*args, **kwargs):
@@ -191,7 +366,9 @@ def cached(keyfn, timeout=300):
                 # expires.
             """
             key = cache_key(args, kwargs)
-            return calculate_and_set(key, args, kwargs)
+            keys = tag_keys(args, kwargs)
+            generations = get_generations(keys, cache.get_many(keys)) if tags is not None else None
+            return calculate_and_set(key, args, kwargs, generations)
 
         @wraps(fn)
         def inner(*args, **kwargs):
@@ -200,12 +377,72 @@ def cached(keyfn, timeout=300):
             already been called with the same args and kwargs.
             """
             key = cache_key(args, kwargs)
-            r = cache.get(key)
-            if r is not None:
+            keys = tag_keys(args, kwargs)
+            fetched = fetch([key], keys)
+            generations = get_generations(keys, fetched) if tags is not None else None
+            entry = fetched.get(key)
+            if is_current(entry, generations):
+                if is_stale(entry):
+                    return recalculate_stale(key, entry.value, args, kwargs, generations)
                 logger.info("%s(%s) gotten from cache" % (fn.__name__, args_kwargs_to_call(args, kwargs)))
-                return r
+                return entry.value
             else:
-                return calculate_and_set(key, args, kwargs)
+                return calculate_and_set(key, args, kwargs, generations)
+
+        def many(arg_tuples, threads=None):
+            """
+            Calls the function once for each tuple of positional arguments in
+            `arg_tuples` and returns the results in the same order.  Cached
+            values are fetched with a single ``get_many``, and the rest are
+            calculated (in a pool of `threads` threads, if given) and stored
+            with a single ``set_many``.
+
+            ::
+
+                totals = order_total.many([(order.pk,) for order in orders])
+            """
+            arg_tuples = [tuple(args) for args in arg_tuples]
+            keys = [cache_key(args, {}) for args in arg_tuples]
+            keys_tags = [tag_keys(args, {}) for args in arg_tuples]
+            all_tag_keys = list(set(k for ks in keys_tags for k in ks))
+            entries = fetch(list(set(keys)), all_tag_keys)
+
+            to_calculate = OrderedDict()
+            locks = []
+            for key, args, ks in zip(keys, arg_tuples, keys_tags):
+                if key in to_calculate:
+                    continue
+                generations = get_generations(ks, entries) if tags is not None else None
+                entry = entries.get(key)
+                if not is_current(entry, generations):
+                    to_calculate[key] = (args, generations)
+                elif is_stale(entry) and cache.add(key + ':lock', 1, grace):
+                    locks.append(key + ':lock')
+                    to_calculate[key] = (args, generations)
+
+            try:
+                if to_calculate:
+                    calculate_args = lambda item: calculate(item[0], {}, item[1])
+                    if threads:
+                        pool = ThreadPool(threads)
+                        try:
+                            calculated = pool.map(calculate_args, list(to_calculate.values()))
+                        finally:
+                            pool.close()
+                            pool.join()
+                    else:
+                        calculated = [calculate_args(item) for item in to_calculate.values()]
+                    calculated = dict(zip(to_calculate, calculated))
+                    cache.set_many(calculated, backend_timeout)
+                    if local_cache is not None:
+                        for key, entry in six.iteritems(calculated):
+                            local_cache.set(key, entry)
+                    entries.update(calculated)
+            finally:
+                if locks:
+                    cache.delete_many(locks)
+
+            return [entries[key].value for key in keys]
 
         def clear_cache(*args, **kwargs):
             """
@@ -223,8 +460,11 @@ def cached(keyfn, timeout=300):
             """
             key = cache_key(args, kwargs)
             cache.delete(key)
+            if local_cache is not None:
+                local_cache.delete(key)
 
         inner.clear_cache = clear_cache
         inner.refresh = refresh
+        inner.many = many
         return inner
     return decorator
@@ -2,7 +2,13 @@ import json
 
 from django.http import HttpResponseRedirect, HttpResponse
 
-from fusionbox.core.serializers import FusionboxJSONEncoder
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # django < 1.5, where HttpResponse sends an iterator as it is consumed
+    StreamingHttpResponse = HttpResponse
+
+from fusionbox.core.serializers import FusionboxJSONEncoder, stream
 
 
 class HttpResponseSeeOther(HttpResponseRedirect):
@@ -25,3 +31,27 @@ class JsonResponse(HttpResponse):
         content = json.dumps(context, cls=FusionboxJSONEncoder)
         super(JsonResponse, self).__init__(content, *args, **kwargs)
         self['Content-Type'] = 'application/json'
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """
+    Like :class:`JsonResponse`, but the body is encoded while it is being
+    sent.  Querysets in the context are read with ``iterator()``, and
+    generators and other iterators are encoded as arrays as they are
+    consumed, so large result sets are never held in memory all at once.
+    The body is sent in pieces of about ``chunk_size`` characters.
+
+    Usage::
+
+        def aview(request):
+            return StreamingJsonResponse({'objects': Thing.objects.all()})
+
+        def export(request):
+            rows = (row.to_json() for row in read_rows())
+            return StreamingJsonResponse(rows)
+    """
+    def __init__(self, context, *args, **kwargs):
+        chunk_size = kwargs.pop('chunk_size', 16384)
+        content = stream(context, chunk_size=chunk_size)
+        super(StreamingJsonResponse, self).__init__(content, *args, **kwargs)
+        self['Content-Type'] = 'application/json'
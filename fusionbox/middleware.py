@@ -1,19 +1,57 @@
 import os
+import re
+import atexit
+import datetime
+import logging
+import mmap
 import errno
+import hashlib
+import struct
+import tempfile
+import threading
+import time
+import weakref
+import zlib
 from six.moves.urllib.parse import urlparse, urljoin
 import warnings
 import itertools
+import six
 
 from collections import defaultdict
 
 from django.conf import settings
 from django.template import TemplateDoesNotExist
-from django.http import Http404, HttpResponse, HttpResponsePermanentRedirect
+from django.template.loader import get_template
+from django.http import Http404, HttpResponse, HttpResponsePermanentRedirect, HttpResponseNotModified
 from django.shortcuts import render
 from django.views.decorators.csrf import requires_csrf_token
 from django.core.exceptions import ImproperlyConfigured
 from django.core import urlresolvers
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
 from django.utils.encoding import iri_to_uri
+from django.utils.http import http_date, parse_http_date_safe
+
+from django.db.models import signals
+from django.dispatch import receiver
+
+from fusionbox.core.utils import LRUCache
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    # django < 1.8
+    from django.test.signals import setting_changed
+
+try:
+    from django.utils.module_loading import import_string
+except ImportError:
+    # django < 1.7
+    from django.utils.importlib import import_module
+
+    def import_string(dotted_path):
+        module_path, class_name = dotted_path.rsplit('.', 1)
+        return getattr(import_module(module_path), class_name)
 
 try:
     from django.contrib.sites.shortcuts import get_current_site
@@ -23,27 +61,147 @@ except ImportError:
 
 import unicodecsv as csv
 
+logger = logging.getLogger(__name__)
+
+
+_missing_templates = None
+
+
+def get_missing_templates():
+    """
+    Returns the :class:`~fusionbox.core.utils.LRUCache` of template names
+    :func:`generic_template_finder_view` knows do not exist, or ``None`` if
+    it is disabled.
+
+    It holds ``settings.GENERIC_TEMPLATE_FINDER_MISSING_CACHE_SIZE`` names
+    (10000 by default, 0 when ``DEBUG`` is on) for
+    ``settings.GENERIC_TEMPLATE_FINDER_MISSING_CACHE_TIMEOUT`` seconds (60 by
+    default), so a new template is found after at most that long.  It is
+    emptied when the template settings change.
+    """
+    global _missing_templates
+    if _missing_templates is None:
+        size = getattr(settings, 'GENERIC_TEMPLATE_FINDER_MISSING_CACHE_SIZE',
+                       0 if settings.DEBUG else 10000)
+        timeout = getattr(settings, 'GENERIC_TEMPLATE_FINDER_MISSING_CACHE_TIMEOUT', 60)
+        _missing_templates = LRUCache(size, timeout) if size else False
+    if _missing_templates is False:
+        return None
+    return _missing_templates
+
+
+@receiver(setting_changed)
+def reset_missing_templates(setting, **kwargs):
+    global _missing_templates
+    if setting in ('DEBUG', 'TEMPLATES', 'TEMPLATE_DIRS', 'TEMPLATE_LOADERS') or \
+            setting.startswith('GENERIC_TEMPLATE_FINDER_'):
+        _missing_templates = None
+
+
+def get_template_dirs():
+    """
+    Returns the directories the template loaders look in, or
+    ``settings.GENERIC_TEMPLATE_FINDER_DIRS`` if it is set.
+    """
+    dirs = getattr(settings, 'GENERIC_TEMPLATE_FINDER_DIRS', None)
+    if dirs is not None:
+        return list(dirs)
+    try:
+        from django.template import engines
+    except ImportError:
+        # django < 1.8
+        from django.template.loaders.app_directories import app_template_dirs
+        dirs = settings.TEMPLATE_DIRS
+        if isinstance(dirs, six.string_types):
+            dirs = [dirs]
+        return list(dirs) + list(app_template_dirs)
+
+    dirs = []
+    loaders = [loader for engine in engines.all() if hasattr(engine, 'engine')
+               for loader in engine.engine.template_loaders]
+    while loaders:
+        loader = loaders.pop(0)
+        # The cached loader wraps other loaders.
+        loaders.extend(getattr(loader, 'loaders', []))
+        if hasattr(loader, 'get_dirs'):
+            dirs.extend(d for d in loader.get_dirs() if d not in dirs)
+    return dirs
+
+
+def build_template_index(dirs):
+    """
+    Returns the set of the names of all the files in the template directories
+    ``dirs``.
+    """
+    index = set()
+    for directory in dirs:
+        directory = six.text_type(directory)
+        for root, _, filenames in os.walk(directory, followlinks=True):
+            relative_root = os.path.relpath(root, directory)
+            for filename in filenames:
+                name = os.path.normpath(os.path.join(relative_root, filename))
+                index.add(name.replace(os.sep, '/'))
+    return index
+
+
+def template_mtime(template_name):
+    """
+    Returns the modification time of the file ``template_name`` is loaded
+    from, or ``None`` if it can't be determined.
+    """
+    try:
+        template = get_template(template_name)
+    except TemplateDoesNotExist:
+        return None
+    # Django >= 1.8 backends wrap the actual template.
+    origin = getattr(getattr(template, 'template', template), 'origin', None)
+    try:
+        return os.path.getmtime(origin.name)
+    except (AttributeError, TypeError, OSError):
+        return None
+
+
+def template_possibilities(path):
+    """
+    Returns the template names :func:`generic_template_finder_view` tries
+    for ``path``, which must end with a slash.
+    """
+    return (
+            path.strip('/') + '.html',
+            path.lstrip('/') + 'index.html',
+            path.strip('/'),
+            )
+
 
 @requires_csrf_token
-def generic_template_finder_view(request, base_path='', extra_context={}):
+def generic_template_finder_view(request, base_path='', extra_context={}, template_index=None):
     """
     Find a template based on the request url and render it.
 
     * ``/`` -> ``index.html``
     * ``/foo/`` -> ``foo.html`` OR ``foo/index.html``
+
+    If ``template_index``, a set of template names as returned by
+    :func:`build_template_index`, is given, only those templates are tried.
+
+    Template names that were not found are remembered for a while, see
+    :func:`get_missing_templates`.
     """
     path = base_path + request.path
     if not path.endswith('/'):
         path += '/'
-    possibilities = (
-            path.strip('/') + '.html',
-            path.lstrip('/') + 'index.html',
-            path.strip('/'),
-            )
+    possibilities = template_possibilities(path)
+    missing_templates = get_missing_templates()
     for t in possibilities:
+        if template_index is not None and t not in template_index:
+            continue
+        if missing_templates is not None and t in missing_templates:
+            continue
         try:
             response = render(request, t, extra_context)
         except (TemplateDoesNotExist):
+            if missing_templates is not None:
+                missing_templates.set(t, True)
             continue
         except OSError as e:
             # If there's a directory that matches the template we're looking for,
@@ -52,6 +210,8 @@ def generic_template_finder_view(request, base_path='', extra_context={}):
             # Python 3 and is a subclass of OSError and its errno corresponds to EISDIR,
             # so for Python 2 compatibility, OSError is caught instead of IsADirectoryError
             if e.errno == errno.EISDIR:
+                if missing_templates is not None:
+                    missing_templates.set(t, True)
                 continue
             else:
                 raise
@@ -61,6 +221,7 @@ def generic_template_finder_view(request, base_path='', extra_context={}):
             # - the path has been modified (slash appended)
             # - and settings.APPEND_SLASH is True
             return HttpResponsePermanentRedirect(path)
+        response.template_name = t
         return response
     raise Http404('Template not found in any of %r' % (possibilities,))
 
@@ -69,7 +230,30 @@ class GenericTemplateFinderMiddleware(object):
     """
     Response middleware that uses :func:`generic_template_finder_view` to attempt to
     autolocate a template for otherwise 404 responses.
+
+    With ``settings.GENERIC_TEMPLATE_FINDER_INDEX`` set to ``True``, the
+    template directories (see :func:`get_template_dirs`) are listed once when
+    the middleware is loaded and urls that don't match any of those files are
+    left as 404s without asking the template loaders.  Templates added after
+    that are not found until the process restarts.
+
+    Set ``settings.GENERIC_TEMPLATE_FINDER_CACHE_TIMEOUT`` to a number of
+    seconds to cache the rendered pages.  Pages are cached per host, path
+    and the values of the request headers listed in
+    ``settings.GENERIC_TEMPLATE_FINDER_CACHE_VARY``.  Cached pages have an
+    ``ETag`` and a ``Last-Modified`` header (the modification time of the
+    template) and conditional requests get a 304.  Pages that use the CSRF
+    token, the session or set cookies are not cached, and neither should
+    pages whose :meth:`get_extra_context` depends on the user.
     """
+    def __init__(self):
+        if getattr(settings, 'GENERIC_TEMPLATE_FINDER_INDEX', False):
+            self.template_index = build_template_index(get_template_dirs())
+        else:
+            self.template_index = None
+        self.cache_timeout = getattr(settings, 'GENERIC_TEMPLATE_FINDER_CACHE_TIMEOUT', None)
+        self.cache_vary = getattr(settings, 'GENERIC_TEMPLATE_FINDER_CACHE_VARY', ())
+
     def process_response(self, request, response):
         """
         Ensures that
@@ -77,13 +261,27 @@ class GenericTemplateFinderMiddleware(object):
         ``GenericTemplateFinderMiddleware``.
         """
         if response.status_code == 404 and not getattr(request, '_generic_template_finder_middleware_view_found', False):
+            if self.template_index is not None and not self.in_template_index(request):
+                return response
+            use_cache = self.cache_timeout is not None and request.method in ('GET', 'HEAD')
+            if use_cache:
+                cached = cache.get(self.get_cache_key(request))
+                if cached is not None:
+                    return self.cached_response(request, *cached)
             try:
                 if hasattr(request, 'urlconf'):
                     # Django calls response middlewares after it has unset the
                     # request's urlconf. Set it temporarily so the template can
                     # reverse properly.
                     urlresolvers.set_urlconf(request.urlconf)
-                return generic_template_finder_view(request, extra_context=self.get_extra_context(request))
+                found = generic_template_finder_view(
+                    request,
+                    extra_context=self.get_extra_context(request),
+                    template_index=self.template_index,
+                )
+                if use_cache and self.is_cacheable(request, found):
+                    return self.cache_response(request, found)
+                return found
             except Http404:
                 return response
             except UnicodeEncodeError:
@@ -93,6 +291,57 @@ class GenericTemplateFinderMiddleware(object):
         else:
             return response
 
+    def get_cache_key(self, request):
+        key = [request.get_host(), request.get_full_path()]
+        key.extend(request.META.get('HTTP_' + header.upper().replace('-', '_'), '')
+                   for header in self.cache_vary)
+        digest = hashlib.md5(u'\n'.join(key).encode('utf-8')).hexdigest()
+        return 'fusionbox.generic_template_finder:%s' % digest
+
+    def is_cacheable(self, request, response):
+        session = getattr(request, 'session', None)
+        return (response.status_code == 200 and
+                not response.cookies and
+                not request.META.get('CSRF_COOKIE_USED') and
+                not (session is not None and session.accessed))
+
+    def cache_response(self, request, response):
+        content = response.content
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        last_modified = template_mtime(response.template_name)
+        cached = (content, response['Content-Type'], etag, last_modified)
+        cache.set(self.get_cache_key(request), cached, self.cache_timeout)
+        return self.cached_response(request, *cached)
+
+    def cached_response(self, request, content, content_type, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_none_match is not None:
+            not_modified = if_none_match.strip() == '*' or etag in [
+                e.strip() for e in if_none_match.split(',')]
+        elif if_modified_since is not None and last_modified is not None:
+            if_modified_since = parse_http_date_safe(if_modified_since)
+            not_modified = if_modified_since is not None and int(last_modified) <= if_modified_since
+        else:
+            not_modified = False
+
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        if self.cache_vary:
+            patch_vary_headers(response, self.cache_vary)
+        return response
+
+    def in_template_index(self, request):
+        path = request.path
+        if not path.endswith('/'):
+            path += '/'
+        return any(t in self.template_index for t in template_possibilities(path))
+
     def process_view(self, request, view_func, view_args, view_kwargs):
         """
         Informs :func:`process_response` that there was a view for this url and that
@@ -104,40 +353,61 @@ class GenericTemplateFinderMiddleware(object):
         return {}
 
 
-def get_redirect(redirects, path, full_uri):
-    if full_uri in redirects:
-        redirect = redirects[full_uri]
-    elif iri_to_uri(path) in redirects:
-        redirect = redirects[iri_to_uri(path)]
-    elif path in redirects:
-        redirect = redirects[path]
-    else:
+def redirect_response(match):
+    """
+    Returns the response for a ``(redirect, target)`` tuple as returned by
+    :meth:`RedirectIndex.match`, or ``None`` if there is no match.
+    """
+    if match is None:
         return None
+    redirect, target = match
 
-    #target = redirec['target']
-    #status_code = redirec['status_code']
-    target = redirect.target
-    status_code = redirect.status_code
-
-    response = HttpResponse('', status=status_code)
+    response = HttpResponse('', status=redirect.status_code)
     response['Location'] = target or None
 
     return response
 
 
+def get_redirect(redirects, path, full_uri):
+    """
+    Returns a redirect response for ``path`` on the host of ``full_uri`` if
+    one of the ``redirects`` matches, otherwise ``None``.
+
+    ``redirects`` is either a :class:`RedirectIndex`, a :class:`RedirectTable`
+    or a dictionary of :class:`Redirect` objects as returned by
+    :func:`preprocess_redirects`.
+    """
+    if isinstance(redirects, dict):
+        redirects = RedirectIndex(redirects.values())
+
+    host = full_uri.split('/', 3)[2] if '://' in full_uri else ''
+    return redirect_response(redirects.match(path, host))
+
+
+def scrape_redirect_file(redirect_path, filename):
+    lines = []
+    path = os.path.join(redirect_path, filename)
+    reader = csv.DictReader(open(path, 'r'), fieldnames=['source', 'target', 'status_code'])
+    for index, line in enumerate(reader):
+        line['filename'] = filename
+        line['line_number'] = index
+        lines.append(line)
+    return lines
+
+
 def scrape_redirects(redirect_path):
     lines = []
     for filename in os.listdir(redirect_path):
         if filename.endswith('.csv'):
-            path = os.path.join(redirect_path, filename)
-            reader = csv.DictReader(open(path, 'r'), fieldnames=['source', 'target', 'status_code'])
-            for index, line in enumerate(reader):
-                line['filename'] = filename
-                line['line_number'] = index
-                lines.append(line)
+            lines.extend(scrape_redirect_file(redirect_path, filename))
     return lines
 
 
+EXACT = 'exact'
+PREFIX = 'prefix'
+PATTERN = 'pattern'
+
+
 class Redirect(object):
     """
     Encapulates all of the information about a redirect.
@@ -145,6 +415,7 @@ class Redirect(object):
     def __init__(self, source, target, status_code, filename, line_number):
         self.source = source.strip()
         self.parsed_source = urlparse(self.source)
+        self.host = self.parsed_source.netloc
         self.target = (target or '').strip()
         self.parsed_target = urlparse(self.target)
         if target:
@@ -157,6 +428,21 @@ class Redirect(object):
 
         self._errors = None
 
+        self.regex = None
+        if self.source.startswith('^'):
+            self.kind = PATTERN
+            try:
+                self.regex = re.compile(self.source)
+            except re.error:
+                pass
+        elif self.source.endswith('*'):
+            self.kind = PREFIX
+        else:
+            self.kind = EXACT
+            # The key exact redirects are looked up by, see RedirectIndex.match.
+            self.path = iri_to_uri(self.parsed_source.path + (
+                '?' + self.parsed_source.query if self.parsed_source.query else ''))
+
     def __str__(self):
         return self.source
 
@@ -169,11 +455,12 @@ class Redirect(object):
     def is_valid(self):
         if self._errors is None:
             self.validate()
-        return bool(self._errors)
+        return not self._errors
 
     def add_error(self, field, message):
         if self._errors is None:
             self._errors = {}
+        self._errors.setdefault(field, []).append(message)
 
     def validate(self):
         self._errors = self._errors or {}
@@ -182,13 +469,477 @@ class Redirect(object):
                     'status_code',
                     "ERROR: {redirect.filename}:{redirect.line_number} - Non 3xx/410 status code({redirect.status_code})".format(redirect=self),
                     )
+        if self.kind == PATTERN and self.regex is None:
+            self.add_error(
+                    'source',
+                    "ERROR: {redirect.filename}:{redirect.line_number} - Invalid regular expression({redirect.source})".format(redirect=self),
+                    )
+        if self.kind == PREFIX and not self.parsed_source.path.endswith('/*'):
+            self.add_error(
+                    'source',
+                    "ERROR: {redirect.filename}:{redirect.line_number} - Prefix redirects must end with '/*' ({redirect.source})".format(redirect=self),
+                    )
+
+    def collapse(self, end):
+        """
+        Redirects straight to where ``end``, the last redirect of the chain
+        this redirect starts, redirects to.
+        """
+        target = end.target
+        if end.parsed_source.netloc and target.startswith('/'):
+            target = '%s://%s%s' % (end.parsed_source.scheme, end.parsed_source.netloc, target)
+        self.target = target
+        self.parsed_target = urlparse(target)
+        self.status_code = end.status_code
+
+    def get_target(self, remainder):
+        """
+        Returns the target for a prefix redirect, substituting the trailing
+        ``*`` of the target with the unmatched ``remainder`` of the path.
+        """
+        if self.target.endswith('*'):
+            return self.target[:-1] + remainder
+        return self.target
+
+
+class _TrieNode(object):
+    __slots__ = ('children', 'redirect')
+
+    def __init__(self):
+        self.children = {}
+        self.redirect = None
+
+
+# The number of hosts RedirectFallbackMiddleware remembers as being the
+# current Site or not.
+SITE_HOSTS_MAX_SIZE = 100
+
+# host -> whether it is the domain of the current Site, shared by all the
+# RedirectFallbackMiddleware instances and cleared when a Site changes.
+_site_hosts = {}
+
+
+def clear_site_hosts(**kwargs):
+    _site_hosts.clear()
+
+
+# Python's re module refuses to compile patterns with more than 100 groups.
+MAX_PATTERN_GROUPS = 99
+
+# Numbered backreferences (``\1``) and conditionals (``(?(1)...)``) refer to
+# groups by position, which changes when patterns are combined.
+GROUP_NUMBER_REFERENCE_RE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?\(')
+
+
+class RedirectIndex(object):
+    """
+    A compiled lookup table for :class:`Redirect` objects.
+
+    Three kinds of sources are supported:
+
+    * exact (``/old/page/``) which are stored in a dictionary per host.
+    * prefix (``/old-blog/*``) which are stored in a trie keyed on path
+      segments, so matching is proportional to the length of the path and
+      not to the number of rules.  A trailing ``*`` in the target is replaced
+      with the rest of the path, ``/old-blog/* -> /blog/*`` redirects
+      ``/old-blog/2012/post/`` to ``/blog/2012/post/``.
+    * pattern (``^/products/(\\d+)/$``) which are matched against the path
+      (including the query string) and combined into a single alternation.
+      The target can reference groups, ``/p/\\1/``.
+
+    Exact matches win over prefix matches, the longest prefix wins and
+    patterns are tried last, in declaration order.  Exact and prefix sources
+    can be limited to a host (``http://example.com/old/``), those win over
+    sources without a host.  The scheme of the source is ignored.
+    """
+    def __init__(self, redirects=()):
+        self.exact = {}
+        self.exact_hosts = {}
+        self.prefixes = {}
+        self.patterns = []
+        self._combined = []
+        for redirect in redirects:
+            self.add(redirect)
+        self.compile_patterns()
+
+    def add(self, redirect):
+        if redirect.kind == EXACT:
+            if redirect.host:
+                self.exact_hosts.setdefault(redirect.host, {})[redirect.path] = redirect
+            else:
+                self.exact[redirect.path] = redirect
+        elif redirect.kind == PREFIX:
+            node = self.prefixes.setdefault(redirect.host, _TrieNode())
+            for segment in iri_to_uri(redirect.parsed_source.path)[1:-2].split('/'):
+                if segment:
+                    node = node.children.setdefault(segment, _TrieNode())
+            node.redirect = redirect
+        elif redirect.regex is not None:
+            self.patterns.append(redirect)
+
+    def compile_patterns(self):
+        """
+        Groups the pattern redirects into as few compiled alternations as
+        possible.  Patterns that refer to groups by number are tried on their
+        own.  Must be called after adding patterns with :meth:`add`.
+        """
+        self._combined = []
+        chunk = []
+        groups = 0
+        for index, redirect in enumerate(self.patterns):
+            if GROUP_NUMBER_REFERENCE_RE.search(redirect.source):
+                # tried on its own, in order
+                if chunk:
+                    self._combined.append(self._combine(chunk))
+                    chunk, groups = [], 0
+                if self._combined and isinstance(self._combined[-1], list):
+                    self._combined[-1].append(redirect)
+                else:
+                    self._combined.append([redirect])
+                continue
+            if chunk and groups + redirect.regex.groups + 1 > MAX_PATTERN_GROUPS:
+                self._combined.append(self._combine(chunk))
+                chunk, groups = [], 0
+            chunk.append(index)
+            groups += redirect.regex.groups + 1
+        if chunk:
+            self._combined.append(self._combine(chunk))
+
+    def _combine(self, indexes):
+        try:
+            return re.compile('|'.join(
+                '(?P<_%d>%s)' % (i, self.patterns[i].source) for i in indexes
+            ))
+        except re.error:
+            # Conflicting named groups, or a pattern that can't be embedded,
+            # fall back to trying each pattern on its own.
+            return [self.patterns[i] for i in indexes]
+
+    def all(self):
+        """
+        Returns a list of all the redirects in the index.
+        """
+        redirects = list(self.exact.values())
+        for exact in self.exact_hosts.values():
+            redirects.extend(exact.values())
+        nodes = list(self.prefixes.values())
+        while nodes:
+            node = nodes.pop()
+            if node.redirect is not None:
+                redirects.append(node.redirect)
+            nodes.extend(node.children.values())
+        return redirects + self.patterns
 
+    def match(self, path, host=''):
+        """
+        Returns a tuple of the matching :class:`Redirect` and the computed
+        target for ``path`` on ``host``, or ``None``.
+        """
+        path = iri_to_uri(path)
+        if host in self.exact_hosts:
+            redirect = self.exact_hosts[host].get(path)
+            if redirect is not None:
+                return redirect, redirect.target
+        redirect = self.exact.get(path)
+        if redirect is not None:
+            return redirect, redirect.target
+
+        if self.prefixes:
+            match = None
+            if host in self.prefixes:
+                match = self.match_prefix(self.prefixes[host], path)
+            if match is None and '' in self.prefixes:
+                match = self.match_prefix(self.prefixes[''], path)
+            if match is not None:
+                return match
+
+        return self.match_pattern(path)
+
+    def match_prefix(self, node, path):
+        best = None
+        if node.redirect is not None:
+            best = (node.redirect, 1)
+        pos = 1
+        while True:
+            end = path.find('/', pos)
+            if end == -1:
+                break
+            node = node.children.get(path[pos:end])
+            if node is None:
+                break
+            pos = end + 1
+            if node.redirect is not None:
+                best = (node.redirect, pos)
+        if best is None:
+            return None
+        redirect, pos = best
+        return redirect, redirect.get_target(path[pos:])
+
+    def match_pattern(self, path):
+        for combined in self._combined:
+            if isinstance(combined, list):
+                for redirect in combined:
+                    m = redirect.regex.match(path)
+                    if m:
+                        return redirect, m.expand(redirect.target)
+            else:
+                m = combined.match(path)
+                if m:
+                    redirect = self.patterns[int(m.lastgroup[1:])]
+                    return redirect, redirect.regex.match(path).expand(redirect.target)
+        return None
+
+
+class RedirectTable(object):
+    """
+    A read-only, memory mapped redirect table compiled by
+    ``./manage.py compile_redirects``.
+
+    Since the file is mapped rather than read, every worker process shares
+    the same copy in the page cache and opening it is instantaneous no matter
+    how many redirects it contains.
+
+    The file layout is::
+
+        header   magic, number of buckets, exact records, rule records
+        buckets  (number of buckets + 1) record offsets
+        records  exact redirects sorted by bucket, then prefix and pattern
+                 redirects, each (key offset, key length, source offset,
+                 source length, target offset, target length, status code)
+        pool     utf-8 encoded sources and targets
+
+    Exact sources are looked up by hashing their host and path into a
+    bucket.  Prefix and
+    pattern redirects are few enough that they are loaded into a
+    :class:`RedirectIndex` when the table is opened.
+    """
+    MAGIC = b'FBREDIR2'
+    HEADER = struct.Struct('<8sIII')
+    OFFSET = struct.Struct('<I')
+    RECORD = struct.Struct('<IIIIIIH')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_buckets, self.n_exact, n_rules = self.HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC:
+            raise ImproperlyConfigured('%s is not a compiled redirect table' % path)
+        self._buckets = self.HEADER.size
+        self._records = self._buckets + self.OFFSET.size * (self.n_buckets + 1)
+
+        self.rules = RedirectIndex(
+            self._redirect(i) for i in range(self.n_exact, self.n_exact + n_rules)
+        )
+
+    @staticmethod
+    def bucket(key, n_buckets):
+        return (zlib.crc32(key) & 0xffffffff) % n_buckets
+
+    def _string(self, offset, length):
+        return self._mmap[offset:offset + length].decode('utf-8')
+
+    def _redirect(self, index):
+        _, _, source_offset, source_length, target_offset, target_length, status_code = \
+            self.RECORD.unpack_from(self._mmap, self._records + index * self.RECORD.size)
+        return Redirect(
+            source=self._string(source_offset, source_length),
+            target=self._string(target_offset, target_length),
+            status_code=status_code,
+            filename=None,
+            line_number=None,
+        )
+
+    def get(self, path, host=''):
+        """
+        Returns the exact :class:`Redirect` for ``path`` on ``host``, or
+        ``None``.
+        """
+        key = (host + path).encode('utf-8')
+        bucket = self.bucket(key, self.n_buckets)
+        start, end = struct.unpack_from('<II', self._mmap, self._buckets + bucket * self.OFFSET.size)
+        for index in range(start, end):
+            offset, length = struct.unpack_from('<II', self._mmap, self._records + index * self.RECORD.size)
+            if length == len(key) and self._mmap[offset:offset + length] == key:
+                return self._redirect(index)
+        return None
+
+    def match(self, path, host=''):
+        """
+        Same as :meth:`RedirectIndex.match`.
+        """
+        if self.n_exact:
+            path = iri_to_uri(path)
+            redirect = (host and self.get(path, host)) or self.get(path)
+            if redirect is not None:
+                return redirect, redirect.target
+        return self.rules.match(path, host)
+
+    @classmethod
+    def write(cls, path, redirects):
+        """
+        Compiles ``redirects``, an iterable of :class:`Redirect` objects, to
+        ``path``.  The file is replaced atomically, so processes that still
+        have the previous table mapped are not affected.
+        """
+        exact, rules = [], []
+        for redirect in redirects:
+            (exact if redirect.kind == EXACT else rules).append(redirect)
 
-def preprocess_redirects(lines, raise_errors=True):
+        n_buckets = max(len(exact), 1)
+        keyed = sorted(
+            ((cls.bucket((r.host + r.path).encode('utf-8'), n_buckets), r) for r in exact),
+            key=lambda item: item[0],
+        )
+
+        pool = []
+        pool_size = [0]
+        pool_start = (cls.HEADER.size + cls.OFFSET.size * (n_buckets + 1) +
+                      cls.RECORD.size * (len(exact) + len(rules)))
+
+        def add_string(value):
+            data = value.encode('utf-8')
+            offset = pool_start + pool_size[0]
+            pool.append(data)
+            pool_size[0] += len(data)
+            return offset, len(data)
+
+        buckets = [0] * (n_buckets + 1)
+        for bucket, redirect in keyed:
+            buckets[bucket + 1] += 1
+        for i in range(n_buckets):
+            buckets[i + 1] += buckets[i]
+
+        records = []
+        for redirect in [r for _, r in keyed] + rules:
+            records.append(cls.RECORD.pack(*(
+                add_string(redirect.host + redirect.path if redirect.kind == EXACT else '') +
+                add_string(redirect.source) + add_string(redirect.target) + (redirect.status_code,)
+            )))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.redirects')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, n_buckets, len(exact), len(rules)))
+                for offset in buckets:
+                    f.write(cls.OFFSET.pack(offset))
+                f.write(b''.join(records))
+                f.write(b''.join(pool))
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+def redirect_graph(redirects):
+    """
+    Returns the redirects that point to other redirects, as two dictionaries
+    of source -> list of sources.  The first one contains the redirects that
+    will certainly be followed by another redirect, the second one those that
+    will only be if the site is hosted on the domain of the target.
+    """
+    edges = {}
+    possible_edges = {}
+    append_slash = settings.APPEND_SLASH
+    for source, redirect in redirects.items():
+        if redirect.kind != EXACT or not redirect.target:
+            continue
+        source_url = redirect.parsed_source
+        target_url = redirect.parsed_target
+
+        path = target_url.path
+        if not path.startswith('/'):
+            path = urljoin(source_url.path, path)
+        paths = [path]
+        if append_slash and not path.endswith('/'):
+            # CommonMiddleware will redirect to the slashed url.
+            paths.append(path + '/')
+
+        hits = []
+        possible_hits = []
+        for path in paths:
+            if target_url.query:
+                path += '?' + target_url.query
+            if target_url.netloc:
+                absolute = '%s://%s%s' % (target_url.scheme, target_url.netloc, path)
+                if absolute in redirects:
+                    hits.append(absolute)
+                if path in redirects:
+                    if target_url.netloc == source_url.netloc:
+                        hits.append(path)
+                    elif not source_url.netloc:
+                        possible_hits.append(path)
+            else:
+                if source_url.netloc:
+                    absolute = '%s://%s%s' % (source_url.scheme, source_url.netloc, path)
+                    if absolute in redirects:
+                        hits.append(absolute)
+                if path in redirects:
+                    hits.append(path)
+        if hits:
+            edges[source] = hits
+        if possible_hits:
+            possible_edges[source] = possible_hits
+    return edges, possible_edges
+
+
+def find_cycles(graph):
+    """
+    Returns the strongly connected components of ``graph`` (a dictionary of
+    node -> list of nodes) that contain a cycle, using an iterative version of
+    Tarjan's algorithm.
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    cycles = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(graph.get(child, ()))))
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in graph.get(node, ()):
+                        cycles.append(component)
+    return cycles
+
+
+def preprocess_redirects(lines, raise_errors=True, collapse_chains=False):
     """
     Takes a list of dictionaries read from the csv redirect files, creates
     Redirect objects from them, and validates the redirects, returning a
     dictionary of Redirect objects.
+
+    Circular redirects of any length are errors.  Redirects to another
+    redirect (chains) are errors too, unless ``collapse_chains`` is True, in
+    which case ``A => B => C`` is rewritten to ``A => C`` as long as every
+    redirect before the last one is permanent.
     """
     error_messages = defaultdict(list)
     warning_messages = defaultdict(list)
@@ -198,38 +949,65 @@ def preprocess_redirects(lines, raise_errors=True):
         redirect = Redirect(**line)
         # Runs internal validation on the redirect
         if not redirect.is_valid():
-            for message in redirect.errors.values():
-                error_messages[redirect.source] = message
+            for messages in redirect.errors.values():
+                error_messages[redirect.source].extend(messages)
 
         # Catch duplicate declaration of source urls.
         if redirect.source in processed_redirects:
-            processed_redirects[redirect.source]
             warning_messages[redirect.source].append("WARNING: {filename}:{line_number} -  Duplicate declaration of url".format(**line))
         processed_redirects[redirect.source] = redirect
 
-    def validate_redirect(redirect, with_slash=False):
-        """
-        Finds circular and possible circular redirects.
-        """
-        to_url = redirect.parsed_target
-        if with_slash:
-            if not to_url.path.endswith('/'):
-                to_url = to_url._replace(path=to_url.path + '/')
+    edges, possible_edges = redirect_graph(processed_redirects)
+
+    in_cycle = set()
+    for cycle in find_cycles(edges):
+        in_cycle.update(cycle)
+        for source in cycle:
+            redirect = processed_redirects[source]
+            error_messages[source].append('ERROR: {redirect.filename}:{redirect.line_number} - Circular redirect: {redirect.source} => {redirect.target}'.format(redirect=redirect))
+
+    # Maps a source to the last redirect of its chain (None if the chain ends
+    # in a cycle) and whether all the redirects before it are permanent.
+    ends = {}
+
+    def chain_end(source):
+        path = []
+        node = source
+        while node not in ends:
+            if node in in_cycle:
+                ends[node] = (None, False)
+            elif node not in edges:
+                ends[node] = (node, True)
             else:
-                return
-        if redirect.target in processed_redirects or redirect.target == redirect.parsed_source.path:
-            error_messages[redirect.source].append('ERROR: {redirect.filename}:{redirect.line_number} - Circular redirect: {redirect.source} => {redirect.target}'.format(redirect=redirect))
-        elif urljoin(redirect.source, to_url.path) in processed_redirects and not redirect.status_code == 410:
-            if not to_url.netloc:
-                error_messages[redirect.source].append('ERROR: {redirect.filename}:{redirect.line_number} - Circular redirect: {redirect.source} => {redirect.target}'.format(redirect=redirect))
-            elif to_url.netloc and not redirect.parsed_source.netloc:
-                warning_messages[redirect.source].append('WARNING: {redirect.filename}:{redirect.line_number}: - Possible circular redirect if hosting on domain {redirect.parsed_target.netloc}: {redirect.source} => {redirect.target}'.format(redirect=redirect))
-
-    # Check for circular redirects.
-    for source, redirect in processed_redirects.items():
-        validate_redirect(redirect)
-        if settings.APPEND_SLASH:
-            validate_redirect(redirect, with_slash=True)
+                path.append(node)
+                node = edges[node][0]
+        end, permanent = ends[node]
+        for node in reversed(path):
+            permanent = permanent and processed_redirects[node].status_code == 301
+            ends[node] = (end, permanent)
+        return ends[source]
+
+    collapsed = {}
+    for source in edges:
+        if source in in_cycle:
+            continue
+        redirect = processed_redirects[source]
+        end, permanent = chain_end(source)
+        if end is None:
+            error_messages[source].append('ERROR: {redirect.filename}:{redirect.line_number} - Redirect to a circular redirect: {redirect.source} => {redirect.target}'.format(redirect=redirect))
+        elif collapse_chains and permanent:
+            collapsed[source] = processed_redirects[end]
+        elif collapse_chains:
+            warning_messages[source].append('WARNING: {redirect.filename}:{redirect.line_number} - Redirect chain with a temporary redirect: {redirect.source} => {redirect.target}'.format(redirect=redirect))
+        else:
+            error_messages[source].append('ERROR: {redirect.filename}:{redirect.line_number} - Redirect chain: {redirect.source} => {redirect.target} => ... => {end}'.format(redirect=redirect, end=end))
+
+    for source, end in collapsed.items():
+        processed_redirects[source].collapse(end)
+
+    for source, possible in possible_edges.items():
+        redirect = processed_redirects[source]
+        warning_messages[source].append('WARNING: {redirect.filename}:{redirect.line_number}: - Possible circular redirect if hosting on domain {redirect.parsed_target.netloc}: {redirect.source} => {redirect.target}'.format(redirect=redirect))
 
     # Now that we're done, either raise an exception if an error was raised and
     # we are not just running in validation mode
@@ -243,6 +1021,110 @@ def preprocess_redirects(lines, raise_errors=True):
     return processed_redirects
 
 
+class CacheHitSink(object):
+    """
+    Stores redirect hit counts in the cache, one dictionary per day.
+
+    Workers flushing at the same moment can overwrite each other's counts.
+    That is acceptable for finding redirects that are never used.
+    """
+    timeout = 60 * 60 * 24 * 90
+
+    def key(self, date):
+        return 'fusionbox.redirect_hits:%s' % date.isoformat()
+
+    def flush(self, hits, date):
+        key = self.key(date)
+        counts = cache.get(key) or {}
+        for source, count in hits.items():
+            counts[source] = counts.get(source, 0) + count
+        cache.set(key, counts, self.timeout)
+
+    def get_hits(self, since):
+        totals = defaultdict(int)
+        days = (datetime.date.today() - since).days + 1
+        keys = [self.key(since + datetime.timedelta(days=i)) for i in range(days)]
+        for counts in cache.get_many(keys).values():
+            for source, count in counts.items():
+                totals[source] += count
+        return totals
+
+
+class FileHitSink(object):
+    """
+    Appends redirect hit counts to ``settings.REDIRECTS_HIT_FILE``, one
+    ``date<TAB>count<TAB>source`` line per redirect and flush.
+    """
+    def __init__(self, path=None):
+        self.path = path or settings.REDIRECTS_HIT_FILE
+
+    def flush(self, hits, date):
+        lines = ''.join(
+            u'%s\t%d\t%s\n' % (date.isoformat(), count, source)
+            for source, count in hits.items()
+        )
+        with open(self.path, 'ab') as f:
+            f.write(lines.encode('utf-8'))
+
+    def get_hits(self, since):
+        totals = defaultdict(int)
+        since = since.isoformat()
+        if not os.path.exists(self.path):
+            return totals
+        with open(self.path, 'rb') as f:
+            for line in f:
+                date, count, source = line.decode('utf-8').rstrip('\n').split('\t', 2)
+                if date >= since:
+                    totals[source] += int(count)
+        return totals
+
+
+class DatabaseHitSink(object):
+    """
+    Stores redirect hit counts in the ``RedirectHit`` model, one row per
+    redirect and day.  ``fusionbox.redirect_hits`` has to be in
+    ``INSTALLED_APPS``.
+    """
+    def flush(self, hits, date):
+        from django.db.models import F
+        from fusionbox.redirect_hits.models import RedirectHit
+        for source, count in hits.items():
+            updated = RedirectHit.objects.filter(source=source, date=date).update(hits=F('hits') + count)
+            if not updated:
+                RedirectHit.objects.create(source=source, date=date, hits=count)
+
+    def get_hits(self, since):
+        from django.db.models import Sum
+        from fusionbox.redirect_hits.models import RedirectHit
+        totals = defaultdict(int)
+        rows = RedirectHit.objects.filter(date__gte=since).values('source').annotate(total=Sum('hits'))
+        for row in rows:
+            totals[row['source']] = row['total']
+        return totals
+
+
+def get_hit_sink():
+    """
+    Returns an instance of the sink configured in
+    ``settings.REDIRECTS_HIT_SINK``, or ``None``.
+    """
+    path = getattr(settings, 'REDIRECTS_HIT_SINK', None)
+    if not path:
+        return None
+    return import_string(path)()
+
+
+# Middleware instances with a hit sink, so their pending hits can be flushed
+# when the process exits.  (weakref.WeakSet is python >= 2.7)
+_hit_counters = weakref.WeakKeyDictionary()
+
+
+@atexit.register
+def flush_all_hits():
+    for middleware in list(_hit_counters):
+        middleware.flush_pending_hits(force=True)
+
+
 class RedirectFallbackMiddleware(object):
     """
     This middleware handles 3xx redirects and 410s.
@@ -257,30 +1139,189 @@ class RedirectFallbackMiddleware(object):
     CSV files should not contain any headers, and be in the format ``source_url,
     target_url, status_code`` where ``status_code`` is optional and defaults to 301.
     To issue a 410, leave off target url and status code.
+
+    Besides exact urls, a source can be a prefix (``/old-blog/*``) or a
+    regular expression (``^/products/(\\d+)/$``), see :class:`RedirectIndex`.
+
+    For large sets of redirects, compile them with ``./manage.py
+    compile_redirects`` and point ``settings.REDIRECTS_TABLE`` to the
+    compiled file.  The CSV files are then not read at all, see
+    :class:`RedirectTable`.
+
+    Set ``settings.REDIRECTS_RELOAD_INTERVAL`` to a number of seconds to pick
+    up changes to the CSV files (or to the compiled table) without restarting.
+    Modification times are checked at most once per interval, only the
+    changed files are parsed again and the new redirects replace the old
+    ones in one step.  If the changed files contain errors, a warning is
+    issued and the previous redirects are kept.
+
+    Redirects to other redirects are errors, set
+    ``settings.REDIRECTS_COLLAPSE_CHAINS`` to ``True`` to have them rewritten
+    to redirect straight to the end of the chain instead.
+
+    To find out which redirects are still used, set
+    ``settings.REDIRECTS_HIT_SINK`` to the dotted path of a sink
+    (:class:`CacheHitSink`, :class:`FileHitSink`, :class:`DatabaseHitSink`
+    or any class with ``flush(hits, date)`` and ``get_hits(since)`` methods).
+    Hits are counted in memory and flushed by the first request after
+    ``settings.REDIRECTS_HIT_FLUSH_INTERVAL`` seconds (60 by default), and
+    when the process exits.  ``DatabaseHitSink`` needs
+    ``fusionbox.redirect_hits`` in ``INSTALLED_APPS``.
+    ``./manage.py unused_redirects`` lists the redirects without hits.
     """
     def __init__(self, *args, **kwargs):
         raise_errors = kwargs.pop('raise_errors', True)
+        use_table = kwargs.pop('use_table', True)
         super(RedirectFallbackMiddleware, self).__init__(*args, **kwargs)
-        raw_redirects = self.get_redirects()
-        self.redirects = preprocess_redirects(raw_redirects, raise_errors)
+        self.table_path = use_table and getattr(settings, 'REDIRECTS_TABLE', None)
+        self.reload_interval = getattr(settings, 'REDIRECTS_RELOAD_INTERVAL', None)
+        self.collapse_chains = getattr(settings, 'REDIRECTS_COLLAPSE_CHAINS', False)
+        self._reload_lock = threading.Lock()
+        self._last_reload_check = time.time()
+        # None until the redirects are loaded by reload_redirects
+        self._mtimes = None
+        self._files = {}
+        self.hit_sink = get_hit_sink()
+        self.hit_flush_interval = getattr(settings, 'REDIRECTS_HIT_FLUSH_INTERVAL', 60)
+        self._hits = defaultdict(int)
+        self._hits_lock = threading.Lock()
+        self._last_hit_flush = time.time()
+        if self.hit_sink is not None:
+            _hit_counters[self] = True
+        if 'django.contrib.sites' in settings.INSTALLED_APPS:
+            from django.contrib.sites.models import Site
+            signals.post_save.connect(clear_site_hosts, sender=Site,
+                                      dispatch_uid='fusionbox.middleware.clear_site_hosts')
+            signals.post_delete.connect(clear_site_hosts, sender=Site,
+                                        dispatch_uid='fusionbox.middleware.clear_site_hosts')
+        if self.table_path:
+            self._mtimes = self.get_mtimes()
+            self.redirects = RedirectTable(self.table_path)
+        elif self.reload_interval:
+            self.redirects = RedirectIndex([])
+            self.reload_redirects(raise_errors)
+        else:
+            raw_redirects = self.get_redirects()
+            self.redirects = RedirectIndex(preprocess_redirects(
+                raw_redirects, raise_errors, self.collapse_chains).values())
 
-    def get_redirects(self):
-        # Get redirect directory
-        redirect_path = getattr(settings, 'REDIRECTS_DIRECTORY',
-                               os.path.join(settings.PROJECT_PATH, '..', 'redirects'))
+    def get_redirect_path(self):
+        return getattr(settings, 'REDIRECTS_DIRECTORY',
+                       os.path.join(settings.PROJECT_PATH, '..', 'redirects'))
 
+    def get_redirects(self):
         # Crawl the REDIRECTS_DIRECTORY scraping any CSV files found
-        lines = scrape_redirects(redirect_path)
+        return scrape_redirects(self.get_redirect_path())
 
-        #redirects = preprocess_redirects(lines)
-        return lines
+    def get_mtimes(self):
+        """
+        Returns a dictionary of the files redirects are read from and their
+        modification times.
+        """
+        if self.table_path:
+            return {self.table_path: os.stat(self.table_path).st_mtime}
+        redirect_path = self.get_redirect_path()
+        return dict(
+            (filename, os.stat(os.path.join(redirect_path, filename)).st_mtime)
+            for filename in os.listdir(redirect_path) if filename.endswith('.csv')
+        )
+
+    def reload_redirects(self, raise_errors=True):
+        """
+        Reloads the redirects if any of the files they come from changed.
+
+        ``raise_errors`` is passed to :func:`preprocess_redirects`; when it
+        raises, the previous redirects are kept.
+        """
+        mtimes = self.get_mtimes()
+        if mtimes == self._mtimes:
+            return
+        if self.table_path:
+            self.redirects = RedirectTable(self.table_path)
+            self._mtimes = mtimes
+            return
+
+        redirect_path = self.get_redirect_path()
+        previous_mtimes = self._mtimes or {}
+        files = {}
+        for filename, mtime in mtimes.items():
+            if previous_mtimes.get(filename) == mtime:
+                files[filename] = self._files[filename]
+            else:
+                files[filename] = scrape_redirect_file(redirect_path, filename)
+
+        lines = list(itertools.chain.from_iterable(files[f] for f in sorted(files)))
+        redirects = preprocess_redirects(lines, raise_errors, self.collapse_chains)
+        self.redirects = RedirectIndex(redirects.values())
+        self._files = files
+        self._mtimes = mtimes
+
+    def check_reload(self):
+        if time.time() - self._last_reload_check < self.reload_interval:
+            return
+        # Only one thread checks, the others keep using the current redirects.
+        if not self._reload_lock.acquire(False):
+            return
+        try:
+            self._last_reload_check = time.time()
+            self.reload_redirects()
+        except ImproperlyConfigured:
+            warnings.warn('There were errors while reloading redirects, keeping the previous redirects.')
+        finally:
+            self._reload_lock.release()
+
+    def is_current_site(self, request):
+        """
+        Returns whether the request is for the domain of the current Site.
+        The answer is cached per host, so checking costs no query.
+        """
+        host = request.get_host()
+        try:
+            return _site_hosts[host]
+        except KeyError:
+            pass
+        if len(_site_hosts) >= SITE_HOSTS_MAX_SIZE:
+            _site_hosts.clear()
+        is_current = _site_hosts[host] = get_current_site(request).domain == host
+        return is_current
 
     def process_response(self, request, response):
-        if response.status_code != 404 and get_current_site(request).domain == request.get_host():
+        if self.hit_sink is not None:
+            self.flush_pending_hits()
+        if response.status_code != 404 and self.is_current_site(request):
             # No need to check for a redirect for non-404 responses, as long as
             # it's our Site.
             return response
-        path = request.get_full_path()
-        full_uri = request.build_absolute_uri()
+        if self.reload_interval:
+            self.check_reload()
+
+        match = self.redirects.match(request.get_full_path(), request.get_host())
+        if match is not None and self.hit_sink is not None:
+            self.count_hit(match[0])
+        return redirect_response(match) or response
 
-        return get_redirect(self.redirects, path, full_uri) or response
+    def count_hit(self, redirect):
+        with self._hits_lock:
+            self._hits[redirect.source] += 1
+        self.flush_pending_hits()
+
+    def flush_pending_hits(self, force=False):
+        """
+        Flushes the hits counted so far to the sink, if the flush interval
+        has passed or ``force`` is True.
+        """
+        with self._hits_lock:
+            if not self._hits:
+                return
+            if not force and time.time() - self._last_hit_flush < self.hit_flush_interval:
+                return
+            hits, self._hits = self._hits, defaultdict(int)
+            self._last_hit_flush = time.time()
+        self.flush_hits(hits)
+
+    def flush_hits(self, hits):
+        try:
+            self.hit_sink.flush(hits, datetime.date.today())
+        except Exception:
+            # Losing some counts is better than failing the request.
+            logger.exception('Could not flush redirect hits')
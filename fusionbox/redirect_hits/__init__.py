@@ -0,0 +1,5 @@
+"""
+Stores the redirect hit counts of
+:class:`fusionbox.middleware.DatabaseHitSink`.  Add ``fusionbox.redirect_hits``
+to ``INSTALLED_APPS`` to use that sink.
+"""
@@ -0,0 +1,15 @@
+from django.db import models
+
+
+class RedirectHit(models.Model):
+    """
+    The number of times a redirect of
+    ``fusionbox.middleware.RedirectFallbackMiddleware`` was used on a day.
+    Written by ``fusionbox.middleware.DatabaseHitSink``.
+    """
+    source = models.TextField()
+    date = models.DateField(db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return u'%s on %s: %d' % (self.source, self.date, self.hits)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'RedirectHit'
+        db.create_table('redirect_hits_redirecthit', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('source', self.gf('django.db.models.fields.TextField')()),
+            ('date', self.gf('django.db.models.fields.DateField')(db_index=True)),
+            ('hits', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+        ))
+        db.send_create_signal('redirect_hits', ['RedirectHit'])
+
+    def backwards(self, orm):
+        # Deleting model 'RedirectHit'
+        db.delete_table('redirect_hits_redirecthit')
+
+    models = {
+        'redirect_hits.redirecthit': {
+            'Meta': {'object_name': 'RedirectHit'},
+            'date': ('django.db.models.fields.DateField', [], {'db_index': 'True'}),
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'source': ('django.db.models.fields.TextField', [], {})
+        }
+    }
+
+    complete_apps = ['redirect_hits']
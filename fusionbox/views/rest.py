@@ -1,29 +1,164 @@
 """
 View classes to help facilitate the creation of REST APIs
 """
+import re
 import json
+import hashlib
+import calendar
+
+try:
+    from collections.abc import Iterator
+except ImportError:
+    # python 2
+    from collections import Iterator
+
+import six
 
 from django.core.exceptions import PermissionDenied, ValidationError
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, HttpResponseNotModified, Http404
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
 from django.views.generic.base import View
+from django.db.models.query import QuerySet
 from django.conf import settings
 
-from fusionbox.core.serializers import FusionboxJSONEncoder
+from fusionbox.core.serializers import FusionboxJSONEncoder, FORMATS, NO_HANDLER, get_format
+from fusionbox.http import StreamingJsonResponse
+
+
+def get_accepted_type(accept, default='application/json'):
+    """
+    Returns the registered content type (see
+    ``fusionbox.core.serializers.register_format``) that the Accept header
+    ``accept`` prefers, or ``default`` if it doesn't accept any of them.
+    """
+    best, best_q = None, 0
+    for media_range in accept.split(','):
+        params = media_range.split(';')
+        media_type = params[0].strip().lower()
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if media_type in ('*/*', 'application/*'):
+            media_type = default
+        if media_type in FORMATS and q > best_q:
+            best, best_q = media_type, q
+    return best or default
 
 
 class JsonResponseMixin(object):
     """
     Sets the response MIME type to ``application/json`` and serializes the
     context obj as a JSON string.
+
+    Set ``streaming`` to ``True`` to send a ``StreamingJsonResponse`` instead,
+    for views that return large querysets.
+
+    Clients can ask for a subset of the fields of the returned object(s)
+    with a comma separated ``?fields=`` parameter (see ``project``).
+
+    Clients that send an Accept header preferring another registered format
+    (MessagePack or CBOR, when those libraries are installed) get the
+    response in that format instead.  Those are not streamed, even if
+    ``streaming`` is set.  Note that CBOR keeps datetimes and Decimals as
+    native CBOR types, where JSON and MessagePack turn them into strings.
     """
+    streaming = False
+    fields_parameter = 'fields'
+
     def render_to_response(self, obj, **response_kwargs):
         """
         Returns an ``HttpResponse`` object instance with Content-Type:
-        application/json.
+        application/json, unless ``get_content_type`` chose another format.
 
-        The response body will be the return value of ``self.serialize(obj)``
+        The response body will be the return value of ``self.serialize(obj)``,
+        or if ``self.streaming`` is set, a ``StreamingJsonResponse`` of
+        ``obj``.
+        """
+        fields = self.get_fields()
+        if fields is not None and response_kwargs.get('status', 200) == 200:
+            obj = self.project(obj, fields)
+        content_type = self.get_content_type()
+        if content_type != 'application/json':
+            dumps = get_format(content_type)[0]
+            response = HttpResponse(dumps(obj), content_type=content_type, **response_kwargs)
+        elif self.streaming:
+            response = StreamingJsonResponse(obj, **response_kwargs)
+        else:
+            response = HttpResponse(self.serialize(obj), content_type='application/json', **response_kwargs)
+        if len(FORMATS) > 1:
+            patch_vary_headers(response, ('Accept',))
+        return response
+
+    def get_content_type(self):
+        """
+        Returns the content type of the response, negotiated from the
+        request's Accept header.
         """
-        return HttpResponse(self.serialize(obj), content_type='application/json', **response_kwargs)
+        return get_accepted_type(self.request.META.get('HTTP_ACCEPT', ''))
+
+    def get_fields(self):
+        """
+        Returns the list of fields requested with ``?fields=``, or ``None``.
+        """
+        if self.fields_parameter is None:
+            return None
+        fields = self.request.GET.get(self.fields_parameter)
+        if not fields:
+            return None
+        return [f.strip() for f in fields.split(',') if f.strip()]
+
+    def project(self, obj, fields):
+        """
+        Restricts ``obj`` to ``fields``.  Dicts keep only those keys, lists
+        and iterators are projected item by item, and other objects are
+        projected after being encoded (with ``to_json`` for example).
+
+        Querysets of models without ``to_json`` (or registered with
+        ``FusionboxJSONEncoder.register_model``) become ``values(*fields)``
+        querysets, so the other columns are never loaded.  Models with
+        ``to_json`` are projected row by row, since deferring the columns
+        ``to_json`` reads would cost a query per row.
+        """
+        if isinstance(obj, dict):
+            return dict((k, obj[k]) for k in fields if k in obj)
+        elif isinstance(obj, QuerySet) and not FusionboxJSONEncoder.has_handler(type(obj)):
+            model = obj.model
+            registered = FusionboxJSONEncoder.model_fields.get(model)
+            if registered is not None or not FusionboxJSONEncoder.has_handler(model):
+                names = registered or self.model_field_names(model)
+                fields = [f for f in fields if f in names]
+                if not fields:
+                    return [{}] * obj.count()
+                return obj.values(*fields)
+            items = obj.iterator()
+        elif isinstance(obj, (list, tuple, Iterator)):
+            items = obj
+        elif obj is None or isinstance(obj, (six.string_types, six.integer_types, float)):
+            return obj
+        else:
+            handler = FusionboxJSONEncoder.get_handler(type(obj))
+            value = NO_HANDLER if handler is None else handler(obj)
+            if value is NO_HANDLER:
+                return obj
+            return self.project(value, fields)
+
+        projected = (self.project(o, fields) for o in items)
+        if self.streaming:
+            return projected
+        return list(projected)
+
+    def model_field_names(self, model):
+        names = set(['pk'])
+        for field in model._meta.fields:
+            names.add(field.name)
+            names.add(field.attname)
+        return names
 
     def serialize(self, obj):
         """
@@ -51,7 +186,7 @@ class JsonRequestMixin(object):
     """
     Adds a ``data`` method on the view instance.  It returns the GET parameters
     if it is a GET request.  It will return the python representation of the
-    JSON sent with the request body.
+    JSON (or other registered format) sent with the request body.
     """
     def data(self):
         """
@@ -60,8 +195,31 @@ class JsonRequestMixin(object):
         if self.request.method == 'GET':
             return self.request.GET
         else:
-            assert self.request.META['CONTENT_TYPE'].startswith('application/json')
-            return json.loads(self.request.body)
+            content_type = self.request.META['CONTENT_TYPE'].split(';')[0].strip().lower()
+            assert content_type in FORMATS
+            return get_format(content_type)[1](self.request.body)
+
+
+ETAG_RE = re.compile(r'(?:W/)?"([^"]*)"')
+
+
+def quote_etag(etag):
+    """
+    Quotes an ETag value, unless it is already quoted (or weak).
+    """
+    if etag.startswith('"') or etag.startswith('W/"'):
+        return etag
+    return '"%s"' % etag
+
+
+def etag_matches(etag, if_none_match):
+    """
+    Weak comparison of ``etag`` against the value of an If-None-Match header.
+    """
+    if if_none_match.strip() == '*':
+        return True
+    opaque = ETAG_RE.match(quote_etag(etag)).group(1)
+    return opaque in ETAG_RE.findall(if_none_match)
 
 
 class RestView(JsonResponseMixin, JsonRequestMixin, View):
@@ -74,7 +232,16 @@ class RestView(JsonResponseMixin, JsonRequestMixin, View):
         - returning a proper error status code.
 
     It also implements a default response for the OPTIONS HTTP request method.
+
+    GET and HEAD requests are conditional: override ``get_etag`` and/or
+    ``get_last_modified`` and a matching If-None-Match or If-Modified-Since
+    header gets a 304 response before the handler runs.  With ``weak_etag``
+    set, responses without an ETag from ``get_etag`` get a weak one computed
+    from the serialized body, which saves the transfer (but not the work)
+    when nothing has changed.
     """
+    weak_etag = False
+
     def auth(*args, **kwargs):
         """
         Hook for implementing custom authentication.
@@ -84,6 +251,67 @@ class RestView(JsonResponseMixin, JsonRequestMixin, View):
         """
         raise NotImplementedError("If you really want no authentication, override this method")
 
+    def get_etag(self, request, *args, **kwargs):
+        """
+        Hook returning the ETag of the resource, or ``None``.  It should be
+        cheaper than the handler itself, eg. a version or hash column.
+        """
+        return None
+
+    def get_last_modified(self, request, *args, **kwargs):
+        """
+        Hook returning the datetime the resource was last modified, or
+        ``None``.  Naive datetimes are taken to be UTC.
+        """
+        return None
+
+    def is_not_modified(self, etag, last_modified):
+        """
+        Returns True if the request's conditional headers match ``etag`` or
+        ``last_modified``.  If-None-Match takes precedence.
+        """
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return etag is not None and etag_matches(etag, if_none_match)
+
+        if_modified_since = parse_http_date_safe(self.request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_modified_since is not None and last_modified is not None:
+            return last_modified <= if_modified_since
+        return False
+
+    def set_conditional_headers(self, response, etag, last_modified):
+        if etag is not None:
+            response['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def conditional_dispatch(self, *args, **kwargs):
+        """
+        Dispatches a GET or HEAD request, answering with a 304 when the
+        client's copy is still current.
+        """
+        etag = self.get_etag(*args, **kwargs)
+        last_modified = self.get_last_modified(*args, **kwargs)
+        if last_modified is not None:
+            last_modified = calendar.timegm(last_modified.utctimetuple())
+
+        if self.is_not_modified(etag, last_modified):
+            return self.set_conditional_headers(HttpResponseNotModified(), etag, last_modified)
+
+        response = super(RestView, self).dispatch(*args, **kwargs)
+        if response.status_code != 200:
+            return response
+
+        # Hashing a streaming body would consume it (StreamingJsonResponse is
+        # a plain HttpResponse on django < 1.5).
+        streaming = getattr(response, 'streaming', False) or isinstance(response, StreamingJsonResponse)
+        if etag is None and self.weak_etag and not streaming:
+            etag = 'W/"%s"' % hashlib.md5(response.content).hexdigest()
+            if self.is_not_modified(etag, last_modified):
+                return self.set_conditional_headers(HttpResponseNotModified(), etag, last_modified)
+        return self.set_conditional_headers(response, etag, last_modified)
+
     def dispatch(self, *args, **kwargs):
         """
         Authenticates the request and dispatches to the correct HTTP method
@@ -97,6 +325,8 @@ class RestView(JsonResponseMixin, JsonRequestMixin, View):
         """
         try:
             self.auth(*args, **kwargs)
+            if self.request.method in ('GET', 'HEAD'):
+                return self.conditional_dispatch(*args, **kwargs)
             return super(RestView, self).dispatch(*args, **kwargs)
         except ValidationError as e:
             return self.render_to_response(e.message_dict, status=409)
@@ -1,4 +1,6 @@
 #!/usr/bin/env python
+import sys
+
 from setuptools import setup, find_packages
 
 __doc__="""
@@ -8,6 +10,10 @@ Useful stuff for django
 
 version = '0.0.2'
 
+install_requires = ['beautifulsoup4', 'PyYAML', 'markdown', 'phonenumbers>=5', 'six', 'unicodecsv']
+if sys.version_info < (2, 7):
+    install_requires.append('ordereddict')
+
 setup(name='django-fusionbox',
     version=version,
     description='Useful stuff for django',
@@ -29,6 +35,6 @@ setup(name='django-fusionbox',
         'Environment :: Web Environment',
         'Framework :: Django',
     ],
-    install_requires = ['beautifulsoup4', 'PyYAML', 'markdown', 'phonenumbers>=5', 'six', 'unicodecsv'],
+    install_requires = install_requires,
     requires = ['beautifulsoup4', 'PyYAML', 'markdown', 'phonenumbers'],
 )
@@ -121,6 +121,7 @@ INSTALLED_APPS = (
     'debug_toolbar',
     'compressor',
     'fusionbox.core',
+    'fusionbox.redirect_hits',
     'south',
     'django_extensions',
     'djangosecure',